@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+    Throughput benchmark of guess-free map generation:
+    the first Board.move of fresh boards over a matrix of sizes and densities.
+
+    python bench_generation.py --runs 200 --output baseline.json
+    python bench_generation.py --runs 200 --baseline baseline.json
+'''
+import argparse
+import json
+import platform
+import random
+import sys
+from time import perf_counter
+
+import numpy as np
+
+import mscore
+from mscore import Board
+
+# (height, width, mines)
+MATRIX = [(8, 8, 9), (10, 10, 15), (12, 8, 20), (5, 5, 10)]
+RUNS = 100
+SEED = 0
+
+def parse_config(text):
+    '''"8x8/9" -> (8, 8, 9)'''
+    (size, mines) = text.split('/')
+    (height, width) = size.lower().split('x')
+    return (int(height), int(width), int(mines))
+
+def config_name(config):
+    (height, width, mines) = config
+    return f"{height}x{width}/{mines}"
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else None
+
+def bench_config(config, runs, seed):
+    '''Returns the result dict of one configuration'''
+    (height, width, mines) = config
+    # the same boards and first moves every run for the same seed
+    random.seed(seed)
+    mscore.default_rng = np.random.default_rng(seed)
+    moves_rng = np.random.default_rng(seed)
+    latencies = list()
+    guessfree = 0
+    attempts = list()
+    total_start = perf_counter()
+    for _ in range(runs):
+        first_move = (int(moves_rng.integers(height)), int(moves_rng.integers(width)))
+        board = Board(height, width, mines)
+        start = perf_counter()
+        board.move(first_move)
+        latencies.append(perf_counter() - start)
+        guessfree += bool(board.guessfree)
+        attempts.append(board.gen_attempts)
+    total_time = perf_counter() - total_start
+    return {
+        'config': config_name(config),
+        'height': height, 'width': width, 'mines': mines,
+        'runs': runs,
+        'boards_per_sec': runs / total_time if total_time else None,
+        'latency_ms': {'mean': float(np.mean(latencies)) * 1000,
+                       'p50': percentile(latencies, 50) * 1000,
+                       'p95': percentile(latencies, 95) * 1000,
+                       'p99': percentile(latencies, 99) * 1000,
+                       'max': max(latencies) * 1000},
+        'guessfree_ratio': guessfree / runs,
+        'attempts': {'mean': float(np.mean(attempts)),
+                     'p50': percentile(attempts, 50),
+                     'p95': percentile(attempts, 95),
+                     'max': int(max(attempts))},
+    }
+
+def compare(results, baseline):
+    '''Print the change against a previous --output file'''
+    previous = {entry['config']: entry for entry in baseline['results']}
+    for entry in results:
+        old = previous.get(entry['config'])
+        if old is None:
+            print(f"{entry['config']}: not in baseline")
+            continue
+        print(f"{entry['config']}: "
+              f"{entry['boards_per_sec']:.1f} boards/s "
+              f"({entry['boards_per_sec'] / old['boards_per_sec']:.2f}x), "
+              f"p95 {entry['latency_ms']['p95']:.1f}ms "
+              f"(was {old['latency_ms']['p95']:.1f}ms), "
+              f"guess free {entry['guessfree_ratio']:.1%} "
+              f"(was {old['guessfree_ratio']:.1%})")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark map generation of mscore.Board')
+    parser.add_argument('--runs', type=int, default=RUNS, help='boards per configuration')
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--config', action='append', type=parse_config, metavar='HxW/M',
+                        help='configuration to run, may be repeated (default: the matrix)')
+    parser.add_argument('--processes', type=int, default=0,
+                        help='generate on a process pool, results are then not deterministic')
+    parser.add_argument('--no-repair', action='store_true', help='set mscore.GEN_REPAIR to False')
+    parser.add_argument('--construct', action='store_true', help='set mscore.GEN_CONSTRUCT to True')
+    parser.add_argument('--construct-density', type=float, default=mscore.GEN_CONSTRUCT_DENSITY,
+                        help='set mscore.GEN_CONSTRUCT_DENSITY, 1 or more to never construct')
+    parser.add_argument('--output', help='write the results as json to this file')
+    parser.add_argument('--baseline', help='compare with the json output of a previous run')
+    args = parser.parse_args()
+
+    mscore.GEN_REPAIR = not args.no_repair
+    mscore.GEN_CONSTRUCT = args.construct
+    mscore.GEN_CONSTRUCT_DENSITY = args.construct_density
+    pool = None
+    if args.processes > 0:
+        from procpool import WorkerPool
+        pool = WorkerPool(args.processes)
+        mscore.executor = pool
+        mscore.SPECULATIVE_BATCH = args.processes
+    try:
+        results = list()
+        for config in args.config or MATRIX:
+            entry = bench_config(config, args.runs, args.seed)
+            results.append(entry)
+            print(f"{entry['config']}: {entry['boards_per_sec']:.1f} boards/s, "
+                  f"p50/p95/p99 {entry['latency_ms']['p50']:.1f}/"
+                  f"{entry['latency_ms']['p95']:.1f}/{entry['latency_ms']['p99']:.1f}ms, "
+                  f"guess free {entry['guessfree_ratio']:.1%}, "
+                  f"{entry['attempts']['mean']:.2f} attempts", file=sys.stderr)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    report = {
+        'seed': args.seed, 'runs': args.runs, 'processes': args.processes,
+        'repair': mscore.GEN_REPAIR, 'construct': mscore.GEN_CONSTRUCT,
+        'construct_density': mscore.GEN_CONSTRUCT_DENSITY,
+        'max_attempts': mscore.MAX_ATTEMPTS,
+        'python': platform.python_version(), 'numpy': np.__version__,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+    Board engine keeping the layers of a game as bitmasks in Python ints,
+    bit row * width + col is a block. Plays exactly like mscore.Board, the
+    map it exposes is built on demand. Meant for bot boards (<= 128 blocks).
+'''
+from functools import lru_cache
+from time import perf_counter
+
+import numpy as np
+
+import mscore
+from mscore import IS_MINE, DEAD, MAX_ATTEMPTS, MoveResult
+from telemetry import SOURCE_CLICK, SOURCE_POOL, SOURCE_BACKGROUND
+
+MAX_CELLS = 128
+
+class Shape:
+    '''Masks shared by every board of one size'''
+    def __init__(self, height, width):
+        self.height = height
+        self.width = width
+        self.cells = height * width
+        self.full = (1 << self.cells) - 1
+        first_col = sum(1 << (row * width) for row in range(height))
+        # blocks that may move right / left by one
+        self.no_last_col = self.full & ~(first_col << (width - 1))
+        self.no_first_col = self.full & ~first_col
+        self.neighbours = [self.dilate(1 << index) & ~(1 << index) for index in range(self.cells)]
+        self.rows = [1 << (index // width) for index in range(self.cells)]
+    def dilate(self, bits):
+        '''bits and every block around them'''
+        bits |= ((bits & self.no_last_col) << 1) | ((bits & self.no_first_col) >> 1)
+        return (bits | (bits << self.width) | (bits >> self.width)) & self.full
+    def flood(self, seeds, zeros):
+        '''The openings of the zero blocks in seeds, with their borders'''
+        region = seeds
+        while True:
+            grown = self.dilate(region) & zeros | region
+            if grown == region:
+                return self.dilate(region)
+            region = grown
+    def to_bits(self, mask):
+        '''bool array -> int'''
+        packed = np.packbits(np.asarray(mask, dtype=bool).reshape(-1), bitorder='little')
+        return int.from_bytes(packed.tobytes(), 'little')
+    def to_mask(self, bits):
+        '''int -> bool array of (height, width)'''
+        packed = np.frombuffer(bits.to_bytes((self.cells + 7) // 8, 'little'), dtype=np.uint8)
+        return np.unpackbits(packed, count=self.cells, bitorder='little') \
+                 .astype(bool).reshape(self.height, self.width)
+
+@lru_cache(maxsize=None)
+def get_shape(height, width):
+    return Shape(height, width)
+
+def popcount(bits):
+    return bin(bits).count('1')
+
+def iter_bits(bits):
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+def layout_statistics(shape, zeros, numbers):
+    '''(op, is, 3bv) of a layout'''
+    s_op = 0
+    bordered = 0
+    left = zeros
+    while left:
+        opening = shape.flood(left & -left, zeros)
+        left &= ~opening
+        bordered |= opening
+        s_op += 1
+    s_is = 0
+    islands = numbers & ~bordered
+    left = islands
+    while left:
+        island = left & -left
+        while True:
+            grown = shape.dilate(island) & islands
+            if grown == island:
+                break
+            island = grown
+        left &= ~island
+        s_is += 1
+    return (s_op, s_is, s_op + popcount(islands))
+
+class BitBoard():
+    def __init__(self, height, width, mines):
+        assert height * width <= MAX_CELLS
+        self.height = height
+        self.width = width
+        self.mines = mines
+        self.moves = list()
+        self.state = 0 # 0:not playing, 1:playing, 2:win, 3:dead
+        self.guessfree = False
+        self.gen_attempts = 0
+        self.gen_time = 0.0
+        self.pending_attempts = 0
+        # made by from_template, the same map is played in other games
+        self.templated = False
+        self.unopened = 0
+        self.mines_opened = 0
+        # the layout, one byte a block
+        self.__layout = None
+        # layers
+        self.__mines = 0
+        self.__zeros = 0
+        self.__opened = 0
+        self.__flagged = 0
+        self.__dead = 0
+        self.__statistics = None
+        self.__map = None
+    @property
+    def shape(self):
+        return get_shape(self.height, self.width)
+    @property
+    def mmap(self):
+        if self.__layout is None:
+            return None
+        return np.frombuffer(self.__layout, dtype=np.int8).reshape(self.height, self.width)
+    @property
+    def map(self):
+        '''The map in mscore.Board encoding, read-only'''
+        if self.__layout is None:
+            return None
+        if self.__map is None:
+            shape = self.shape
+            cells = self.mmap.copy()
+            cells[shape.to_mask(self.__opened | self.__flagged)] += 10
+            cells[shape.to_mask(self.__dead)] = DEAD
+            cells.flags.writeable = False
+            self.__map = cells
+        return self.__map
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_BitBoard__map'] = None
+        return state
+
+    def __set_layout(self, layout):
+        shape = self.shape
+        self.__layout = np.asarray(layout, dtype=np.int8).tobytes()
+        self.__mines = shape.to_bits(layout == IS_MINE)
+        self.__zeros = shape.to_bits(layout == 0)
+        self.__opened = 0
+        self.__flagged = 0
+        self.__dead = 0
+        self.__statistics = layout_statistics(shape, self.__zeros,
+                                              shape.full & ~self.__mines & ~self.__zeros)
+        self.__map = None
+        self.unopened = shape.cells - popcount(self.__mines)
+        self.mines_opened = 0
+    def __gen_map(self, first_move, deadline=None, source=SOURCE_CLICK):
+        if self.mines >= self.height * self.width:
+            return
+        elif self.mines < 0:
+            return
+        (result, self.gen_time) = mscore.gen_recorded(self.height, self.width, self.mines,
+                                                      first_move, deadline=deadline,
+                                                      source=source)
+        self.__set_layout(result.layout)
+        self.guessfree = result.guessfree
+        self.gen_attempts = result.attempts
+        self.pending_attempts = 0 if result.guessfree else \
+            max(0, MAX_ATTEMPTS - result.attempts)
+    def __reveal(self, covered):
+        '''Open the unopened blocks in covered for the player, mines get flagged'''
+        mines = covered & self.__mines
+        if mines:
+            self.__flagged |= mines
+            self.mines_opened += popcount(mines)
+        safe = covered & ~mines
+        zeros = safe & self.__zeros
+        if zeros:
+            safe |= self.shape.flood(zeros, self.__zeros)
+        safe &= ~self.__opened
+        self.__opened |= safe
+        self.unopened -= popcount(safe)
+    def __open(self, index):
+        if self.state != 1:
+            return
+        bit = 1 << index
+        visible = self.__opened | self.__flagged | self.__dead
+        if bit & self.__mines & ~visible:
+            self.__dead |= bit
+            self.state = 3
+            self.mines_opened += 1
+            return
+        elif bit & visible:
+            # already opened, value is the number or what 19 / 20 would give
+            if bit & self.__opened:
+                value = self.__layout[index]
+            else:
+                value = DEAD - 10 if bit & self.__dead else IS_MINE
+            neighbours = self.shape.neighbours[index]
+            neighbour_mine_opened = popcount(neighbours & (self.__flagged | self.__dead))
+            covered = neighbours & ~visible
+            if neighbour_mine_opened == value or \
+               popcount(covered) == value - neighbour_mine_opened:
+                self.__reveal(covered)
+        else:
+            self.__reveal(bit)
+        if self.mines_opened == self.mines or self.unopened == 0:
+            self.state = 2
+
+    def generate(self, first_move):
+        '''Generate the map for first_move without opening anything, for the pool'''
+        self.__gen_map(first_move, source=SOURCE_POOL)
+    def load(self, layout, guessfree=True):
+        '''Use a pre-generated layout instead of generating one'''
+        self.__set_layout(layout)
+        self.guessfree = guessfree
+        self.pending_attempts = 0
+
+    def move(self, row_col, budget=None):
+        '''Same as mscore.Board.move'''
+        if self.state == 0:
+            layout = mscore.ready_layout(self.height, self.width, self.mines, row_col)
+            if layout is not None:
+                self.load(layout)
+            else:
+                self.__gen_map(row_col, deadline=None if budget is None
+                                                 else perf_counter() + budget)
+            self.state = 1
+        self.moves.append(tuple(row_col))
+        (row, col) = row_col
+        if self.__layout is None:
+            return MoveResult([], 0, self.state)
+        before = self.__opened | self.__flagged | self.__dead
+        self.__open(row * self.width + col)
+        changed = (self.__opened | self.__flagged | self.__dead) & ~before
+        if changed:
+            self.__map = None
+        rows = 0
+        cells = list()
+        for index in iter_bits(changed):
+            rows |= self.shape.rows[index]
+            cells.append(divmod(index, self.width))
+        return MoveResult(cells, rows, self.state)
+
+    @classmethod
+    def from_template(cls, template):
+        '''A board playing template, with its first move already opened'''
+        board = cls(template.height, template.width, template.mines)
+        board.load(template.mmap, guessfree=template.guessfree)
+        shape = board.shape
+        start = template.start
+        board.__opened = shape.to_bits((start >= 10) & (start <= 18))
+        board.__flagged = shape.to_bits(start == IS_MINE + 10)
+        board.__dead = shape.to_bits(start == DEAD)
+        board.templated = True
+        board.state = template.state
+        board.moves = [template.first_move]
+        board.unopened = template.unopened
+        board.mines_opened = template.mines_opened
+        board.__statistics = template.statistics
+        return board
+
+    def continue_generation(self):
+        '''Same as mscore.Board.continue_generation'''
+        (attempts, self.pending_attempts) = (self.pending_attempts, 0)
+        if attempts <= 0 or not self.moves:
+            return None
+        (result, _) = mscore.gen_recorded(self.height, self.width, self.mines, self.moves[0],
+                                          budget=attempts, source=SOURCE_BACKGROUND)
+        return result.layout if result.guessfree else None
+
+    def swap_layout(self, layout):
+        '''Same as mscore.Board.swap_layout'''
+        if self.state != 1 or len(self.moves) != 1:
+            return False
+        self.load(layout)
+        (row, col) = self.moves[0]
+        self.__open(row * self.width + col)
+        return True
+
+    def gen_statistics(self):
+        '''(op, is, 3bv) of the map, worked out when it was set'''
+        return self.__statistics
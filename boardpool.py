@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from collections import deque
+from threading import Condition, Thread
+from random import choice
+from time import monotonic
+import logging
+
+from mscore import Board
+
+logger = logging.getLogger('tgmsbot.boardpool')
+
+# seconds a registered key waits after a generation that was not guess free,
+# doubled for every further failure in a row, up to RETRY_MAX
+RETRY_BACKOFF = 1.0
+RETRY_MAX = 300.0
+
+# symmetries of a rectangle, as (transpose, flip_rows, flip_cols) applied in that order
+TRANSFORMS = [(transpose, flip_rows, flip_cols) for transpose in (False, True)
+              for flip_rows in (False, True) for flip_cols in (False, True)]
+
+def transform_move(height, width, first_move, transform):
+    '''Returns (height, width, first_move) of the transformed board'''
+    (transpose, flip_rows, flip_cols) = transform
+    (row, col) = first_move
+    if transpose:
+        (height, width, row, col) = (width, height, col, row)
+    if flip_rows:
+        row = height - 1 - row
+    if flip_cols:
+        col = width - 1 - col
+    return (height, width, (row, col))
+
+def transform_layout(layout, transform):
+    (transpose, flip_rows, flip_cols) = transform
+    if transpose:
+        layout = layout.T
+    if flip_rows:
+        layout = layout[::-1, :]
+    if flip_cols:
+        layout = layout[:, ::-1]
+    return layout
+
+def untransform_layout(layout, transform):
+    '''Turn a transformed layout back into the original board'''
+    (transpose, flip_rows, flip_cols) = transform
+    if flip_cols:
+        layout = layout[:, ::-1]
+    if flip_rows:
+        layout = layout[::-1, :]
+    if transpose:
+        layout = layout.T
+    return layout
+
+def canonical_key(height, width, mines, first_move):
+    '''
+        The smallest (height, width, mines, first_move) among the symmetries of the board,
+        and the transforms which lead to it. A guess-free layout stays guess free
+        when the board and its first move are transformed the same way.
+    '''
+    candidates = dict()
+    for transform in TRANSFORMS:
+        (theight, twidth, tmove) = transform_move(height, width, tuple(first_move), transform)
+        candidates.setdefault((theight, twidth, mines, tmove), list()).append(transform)
+    key = min(candidates)
+    return (key, candidates[key])
+
+class BoardPool:
+    '''
+        Guess-free layouts generated ahead of time,
+        keyed by canonical (height, width, mines, first_move) under the symmetries
+        of the board, so one stored layout serves up to 8 first moves.
+        A key is refilled by background workers once it drops to
+        low_watermark layouts, until it holds high_watermark layouts again.
+        prefetch() asks for one layout of a key for a limited time.
+        A key that is not registered by track() is dropped after max_failures
+        generations in a row were not guess free, and not picked up again;
+        a registered one is retried later, see RETRY_BACKOFF.
+    '''
+    def __init__(self, high_watermark=3, low_watermark=1, workers=1, max_keys=256,
+                 max_failures=3):
+        assert 0 <= low_watermark < high_watermark
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.workers = workers
+        # keys that are not registered by track() are forgotten
+        # in FIFO order once there are more than max_keys of them
+        self.max_keys = max_keys
+        self.max_failures = max_failures
+        self.__cond = Condition()
+        # key -> deque of layouts
+        self.__layouts = dict()
+        # keys kept topped up, in the order they were registered
+        self.__tracked = dict()
+        # keys under refill, from low_watermark up to high_watermark
+        self.__refilling = set()
+        # prefetched keys -> monotonic time they are forgotten at
+        self.__expires = dict()
+        # key -> generations in a row that were not guess free
+        self.__failures = dict()
+        # registered keys waiting after a failure -> monotonic time to retry at
+        self.__retry_at = dict()
+        self.__threads = list()
+        self.__stopped = False
+        # counters
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.discarded = 0
+        self.dropped = 0
+        self.prefetches = 0
+        self.prefetch_hits = 0
+        self.prefetch_expired = 0
+
+    def track(self, height, width, mines, first_moves=None):
+        '''
+            Keep layouts for these first moves topped up,
+            every cell of the board if first_moves is None.
+        '''
+        if first_moves is None:
+            first_moves = [(row, col) for row in range(height) for col in range(width)]
+        with self.__cond:
+            for first_move in first_moves:
+                (key, _) = canonical_key(height, width, mines, first_move)
+                self.__tracked[key] = True
+                self.__layouts.setdefault(key, deque())
+                self.__refilling.add(key)
+            self.__cond.notify_all()
+
+    def __hopeless(self, key):
+        return self.__failures.get(key, 0) >= self.max_failures
+
+    def __forget(self, key):
+        self.__tracked.pop(key, None)
+        self.__layouts.pop(key, None)
+        self.__refilling.discard(key)
+        self.__expires.pop(key, None)
+
+    def __track_on_miss(self, key):
+        if key in self.__tracked or self.__hopeless(key):
+            return
+        self.__tracked[key] = False
+        self.__layouts.setdefault(key, deque())
+        auto_keys = [k for (k, pinned) in self.__tracked.items() if not pinned]
+        while len(auto_keys) > self.max_keys:
+            self.__forget(auto_keys.pop(0))
+
+    def prefetch(self, height, width, mines, first_moves, ttl):
+        '''
+            Generate layouts for a game that will probably be played soon,
+            forget them if that has not happened within ttl seconds.
+        '''
+        with self.__cond:
+            self.__expire()
+            keys = {canonical_key(height, width, mines, first_move)[0] for first_move in first_moves}
+            for key in keys:
+                if self.__tracked.get(key) or self.__hopeless(key):
+                    # pinned, always there, or never guess free
+                    continue
+                self.__track_on_miss(key)
+                self.__expires[key] = monotonic() + ttl
+                if not self.__layouts[key]:
+                    self.__refilling.add(key)
+                self.prefetches += 1
+            self.__cond.notify_all()
+
+    def __expire(self):
+        now = monotonic()
+        for (key, expires) in list(self.__expires.items()):
+            if expires <= now:
+                self.__expires.pop(key)
+                if self.__tracked.get(key) is False:
+                    self.__tracked.pop(key)
+                    self.__refilling.discard(key)
+                    if self.__layouts.pop(key, None):
+                        self.prefetch_expired += 1
+
+    def take(self, height, width, mines, first_move):
+        '''Pop a guess-free layout in O(1), None if there is none'''
+        (key, transforms) = canonical_key(height, width, mines, first_move)
+        with self.__cond:
+            self.__expire()
+            layouts = self.__layouts.get(key)
+            if layouts:
+                layout = layouts.popleft()
+                self.hits += 1
+                if key in self.__expires:
+                    self.prefetch_hits += 1
+            else:
+                layout = None
+                self.misses += 1
+                self.__track_on_miss(key)
+            # a prefetched key is only refilled by the next prefetch()
+            if key in self.__tracked and key not in self.__expires and \
+               len(self.__layouts[key]) <= self.low_watermark:
+                self.__refilling.add(key)
+                self.__cond.notify()
+        if layout is not None:
+            # any of them, if the first move is on an axis of symmetry
+            layout = untransform_layout(layout, choice(transforms))
+        return layout
+
+    def put(self, height, width, mines, first_move, layout):
+        (key, transforms) = canonical_key(height, width, mines, first_move)
+        layout = transform_layout(layout, transforms[0])
+        with self.__cond:
+            if key not in self.__tracked:
+                return
+            layouts = self.__layouts[key]
+            layouts.append(layout)
+            # one layout is enough for a prefetched game
+            if len(layouts) < (1 if key in self.__expires else self.high_watermark):
+                self.__refilling.add(key)
+                self.__cond.notify()
+
+    def __next_key(self):
+        '''(key to refill or None, seconds until a waiting key may be retried)'''
+        self.__expire()
+        now = monotonic()
+        timeout = None
+        for key in self.__refilling:
+            retry_at = self.__retry_at.get(key)
+            if retry_at is None or retry_at <= now:
+                self.__retry_at.pop(key, None)
+                return (key, None)
+            if timeout is None or retry_at - now < timeout:
+                timeout = retry_at - now
+        return (None, timeout)
+
+    def __failed(self, key):
+        '''A generation for key was not guess free'''
+        failures = self.__failures[key] = self.__failures.get(key, 0) + 1
+        # remember failing keys of up to max_keys boards
+        while len(self.__failures) > self.max_keys:
+            self.__failures.pop(next(iter(self.__failures)))
+        if self.__tracked.get(key):
+            self.__retry_at[key] = monotonic() + min(RETRY_BACKOFF * 2 ** (failures - 1), RETRY_MAX)
+            self.__refilling.add(key)
+        elif failures >= self.max_failures:
+            if key in self.__tracked:
+                self.dropped += 1
+            self.__forget(key)
+        elif key in self.__tracked:
+            self.__refilling.add(key)
+
+    def __refill_loop(self):
+        while True:
+            with self.__cond:
+                while not self.__stopped:
+                    (key, timeout) = self.__next_key()
+                    if key is not None:
+                        break
+                    self.__cond.wait(timeout)
+                if self.__stopped:
+                    return
+                # let other workers pick another key meanwhile
+                self.__refilling.discard(key)
+            (height, width, mines, first_move) = key
+            try:
+                board = Board(height, width, mines)
+                board.generate(first_move)
+            except Exception:
+                logger.exception(f'Unable to generate a layout for {key}')
+                continue
+            with self.__cond:
+                if not board.guessfree:
+                    self.discarded += 1
+                    self.__failed(key)
+                    continue
+                self.__failures.pop(key, None)
+                self.generated += 1
+            self.put(height, width, mines, first_move, board.mmap)
+
+    def start(self):
+        for _ in range(self.workers):
+            tr = Thread(target=self.__refill_loop, daemon=True)
+            tr.start()
+            self.__threads.append(tr)
+
+    def stop(self):
+        with self.__cond:
+            self.__stopped = True
+            self.__cond.notify_all()
+
+    def stats(self):
+        with self.__cond:
+            self.__expire()
+            stored = sum(len(layouts) for layouts in self.__layouts.values())
+            return {'keys': len(self.__tracked), 'stored': stored,
+                    'refilling': len(self.__refilling),
+                    'hits': self.hits, 'misses': self.misses,
+                    'generated': self.generated, 'discarded': self.discarded,
+                    'dropped': self.dropped,
+                    'prefetches': self.prefetches, 'prefetch_hits': self.prefetch_hits,
+                    'prefetch_expired': self.prefetch_expired}
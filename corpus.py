@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+    On-disk library of verified guess-free boards, memory-mapped read-only.
+
+    python corpus.py build corpus.npy --config 8x8/9 --count 1000
+    python corpus.py info corpus.npy
+'''
+import argparse
+import os
+from bisect import bisect_left
+from threading import Lock
+
+import numpy as np
+
+import mscore
+from mscore import Board
+from boardpool import canonical_key, transform_layout, untransform_layout
+
+# largest board a record can hold
+MAX_CELLS = 1024
+BITMAP_BYTES = MAX_CELLS // 8
+
+# Records are sorted by key, which packs
+# (height, width, mines, first row, first col, 3bv) of the canonical board
+RECORD = np.dtype([
+    ('key', '<u8'),
+    ('height', 'u1'), ('width', 'u1'), ('mines', '<u2'),
+    ('row', 'u1'), ('col', 'u1'),
+    ('op', '<u2'), ('is', '<u2'), ('bbbv', '<u2'),
+    ('difficulty', '<f4'),
+    ('bitmap', 'u1', (BITMAP_BYTES,)),
+])
+# bit widths of the key fields, from the highest
+KEY_BITS = (8, 8, 12, 8, 8, 12)
+
+# difficulty is the sum of these over the solver moves
+DIFFICULTY_WEIGHTS = {'Naive': 0, 'Groups': 1, 'Subgroups': 2,
+                      'Coverage': 3, 'CSP': 4, 'Bruteforce': 5}
+
+def make_key(height, width, mines, row, col, bbbv):
+    key = 0
+    for (value, bits) in zip((height, width, mines, row, col, bbbv), KEY_BITS):
+        assert 0 <= value < (1 << bits)
+        key = (key << bits) | int(value)
+    return key
+
+def solver_difficulty(layout, first_move):
+    '''Weighted count of the non-trivial deductions, None if not guess free'''
+    (game, solver) = mscore.start_game(layout, first_move)
+    if not solver.is_game_deterministic(game):
+        return None
+    return float(sum(DIFFICULTY_WEIGHTS.get(method, 0) for method in solver.move_methods))
+
+def make_record(layout, first_move):
+    '''
+        The record of a guess-free layout, stored under its canonical first move.
+        Returns None if the layout is not guess free.
+    '''
+    (height, width) = layout.shape
+    mines = int(np.count_nonzero(layout == mscore.IS_MINE))
+    assert height * width <= MAX_CELLS
+    difficulty = solver_difficulty(layout, first_move)
+    if difficulty is None:
+        return None
+    (s_op, s_is, s_3bv) = mscore.layout_statistics(layout)
+    ((theight, twidth, _, (row, col)), transforms) = canonical_key(height, width, mines, first_move)
+    canonical = transform_layout(layout, transforms[0])
+    record = np.zeros((), dtype=RECORD)
+    record['key'] = make_key(theight, twidth, mines, row, col, s_3bv)
+    record['height'] = theight
+    record['width'] = twidth
+    record['mines'] = mines
+    record['row'] = row
+    record['col'] = col
+    record['op'] = s_op
+    record['is'] = s_is
+    record['bbbv'] = s_3bv
+    record['difficulty'] = difficulty
+    bits = np.packbits(canonical == mscore.IS_MINE)
+    record['bitmap'][:len(bits)] = bits
+    return record
+
+def record_layout(record):
+    '''The canonical layout of a record'''
+    (height, width) = (int(record['height']), int(record['width']))
+    mine_mask = np.unpackbits(record['bitmap'], count=height * width).astype(bool)
+    return mscore.count_neighbours(mine_mask.reshape(height, width))
+
+class Corpus:
+    '''
+        Verified boards in a .npy file of RECORD, memory-mapped so nothing
+        is read until used. Lookups are a binary search on the sorted keys.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.records = np.load(path, mmap_mode='r')
+        assert self.records.dtype == RECORD
+        # a strided view on the mapped file, no copy
+        self.keys = self.records['key']
+        self.__lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.records)
+
+    def find(self, height, width, mines, first_move, bbbv=None):
+        '''
+            Indexes [start, stop) of the records for this board and first move,
+            optionally with 3bv in the range bbbv = (low, high), both inclusive.
+        '''
+        ((theight, twidth, _, (row, col)), _) = canonical_key(height, width, mines, first_move)
+        if theight * twidth > MAX_CELLS:
+            return (0, 0)
+        (low, high) = bbbv if bbbv is not None else (0, (1 << KEY_BITS[-1]) - 1)
+        low = max(low, 0)
+        high = min(high, (1 << KEY_BITS[-1]) - 1)
+        if low > high:
+            return (0, 0)
+        start = bisect_left(self.keys, make_key(theight, twidth, mines, row, col, low))
+        stop = bisect_left(self.keys, make_key(theight, twidth, mines, row, col, high) + 1)
+        return (start, stop)
+
+    def take(self, height, width, mines, first_move, bbbv=None, rng=None):
+        '''A random matching layout, turned to first_move, None if there is none'''
+        if rng is None:
+            rng = mscore.default_rng
+        (start, stop) = self.find(height, width, mines, first_move, bbbv=bbbv)
+        with self.__lock:
+            if start >= stop:
+                self.misses += 1
+                return None
+            self.hits += 1
+        layout = record_layout(self.records[int(rng.integers(start, stop))])
+        (_, transforms) = canonical_key(height, width, mines, first_move)
+        return untransform_layout(layout, transforms[rng.integers(len(transforms))])
+
+    def stats(self):
+        with self.__lock:
+            return {'boards': len(self), 'hits': self.hits, 'misses': self.misses}
+
+def build(path, configs, count, first_moves=None):
+    '''
+        Generate count guess-free boards for each (height, width, mines) in configs
+        and merge them into the corpus file at path. The file is replaced atomically,
+        running bots keep the old mapping until they reload.
+        first_moves: None for random first moves, else a list of (row, col).
+    '''
+    rng = np.random.default_rng()
+    records = list()
+    for (height, width, mines) in configs:
+        for i in range(count):
+            if first_moves is None:
+                first_move = (int(rng.integers(height)), int(rng.integers(width)))
+            else:
+                first_move = first_moves[i % len(first_moves)]
+            board = Board(height, width, mines)
+            board.generate(first_move)
+            if not board.guessfree:
+                continue
+            record = make_record(board.mmap, first_move)
+            if record is not None:
+                records.append(record)
+    new = np.array(records, dtype=RECORD)
+    if os.path.exists(path):
+        new = np.concatenate([np.load(path), new])
+    new = new[np.argsort(new['key'], kind='stable')]
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, new)
+    os.replace(tmp_path, path)
+    return len(records)
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or inspect a corpus of guess-free boards')
+    sub = parser.add_subparsers(dest='command', required=True)
+    parser_build = sub.add_parser('build', help='generate boards and add them to the corpus')
+    parser_build.add_argument('path')
+    parser_build.add_argument('--config', action='append', required=True, metavar='HxW/M')
+    parser_build.add_argument('--count', type=int, default=100, help='boards per configuration')
+    parser_build.add_argument('--first-move', action='append', metavar='ROW,COL',
+                              help='first moves to use in turn (default: random)')
+    parser_info = sub.add_parser('info', help='show what is in the corpus')
+    parser_info.add_argument('path')
+    args = parser.parse_args()
+    if args.command == 'build':
+        configs = list()
+        for text in args.config:
+            (size, mines) = text.split('/')
+            (height, width) = size.lower().split('x')
+            configs.append((int(height), int(width), int(mines)))
+        first_moves = None
+        if args.first_move:
+            first_moves = [tuple(int(i) for i in text.split(',')) for text in args.first_move]
+        added = build(args.path, configs, args.count, first_moves=first_moves)
+        print(f"added {added} boards to {args.path}")
+    else:
+        corpus = Corpus(args.path)
+        records = corpus.records
+        print(f"{len(corpus)} boards")
+        sizes = np.unique(records[['height', 'width', 'mines']])
+        for (height, width, mines) in sizes:
+            mask = (records['height'] == height) & (records['width'] == width) & \
+                   (records['mines'] == mines)
+            print(f"{height}x{width}/{mines}: {np.count_nonzero(mask)} boards, "
+                  f"3bv {records['bbbv'][mask].min()}-{records['bbbv'][mask].max()}, "
+                  f"difficulty {records['difficulty'][mask].mean():.1f} avg")
+
+if __name__ == '__main__':
+    main()
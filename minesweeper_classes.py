@@ -2,8 +2,39 @@ import math
 import itertools
 from dataclasses import dataclass
 
+import numpy as np
+
 import minesweeper_game as mg
 
+# GroupCluster.solve_cluster gives up on clusters with more solutions
+# (of classes of cells, each stands for one or more solutions of cells)
+MAX_CLUSTER_SOLUTIONS = 1_000_000
+# Solutions are kept in matrices of (at most) this many rows
+SOLUTIONS_CHUNK = 4096
+
+# Flat index of every cell seen so far: bit positions in MineGroup.mask.
+# Cells keep their index for good, whatever the shape of the field
+CELL_INDEXES = {}
+_new_cell_index = itertools.count()
+
+
+def cell_bit(cell):
+    ''' Bit of the cell in the group masks
+    '''
+    index = CELL_INDEXES.get(cell)
+    if index is None:
+        index = CELL_INDEXES.setdefault(cell, next(_new_cell_index))
+    return 1 << index
+
+
+def cells_mask(cells):
+    ''' Bitmask of a collection of cells
+    '''
+    mask = 0
+    for cell in cells:
+        mask |= cell_bit(cell)
+    return mask
+
 
 class MineGroup:
     ''' A MineGroup is a set of cells that are known
@@ -13,13 +44,18 @@ class MineGroup:
     This is a basic element for Groups and Subgroups solving methods.
     '''
 
-    def __init__(self, cells, mines, group_type="exactly"):
+    def __init__(self, cells, mines, group_type="exactly", mask=None):
         ''' Cells in questions. Number of mines that those cells have.
+        mask: cells_mask(cells), if the caller already has it.
         '''
         # Use set rather than list as it speeds up some calculations
         self.cells = set(cells)
         self.mines = mines
 
+        # Same cells as a bitmask: subset, difference and overlap checks
+        # between groups are single int operations
+        self.mask = cells_mask(self.cells) if mask is None else mask
+
         # Group type ("exactly", "no more than", "at least")
         self.group_type = group_type
 
@@ -44,12 +80,14 @@ class MineGroup:
     def calculate_hash(self):
         ''' Hash of a group. To check if such group is already in self.group
         '''
-        # Prepare data for hashing: sort cells, add self.mines
-        for_hash = sorted(list(self.cells)) + [self.mines] + [self.group_type]
-        # Make immutable
-        for_hash = tuple(for_hash)
-        # Return hash
-        return hash(for_hash)
+        # The mask stands for the (sorted) cells. Kept as a tuple, not
+        # hash() of it: int hashes wrap around at 61 bits, masks do not
+        return (self.mask, self.mines, self.group_type)
+
+    def is_subset(self, other):
+        ''' Are all cells of this group in the other group
+        '''
+        return self.mask & ~other.mask == 0
 
     def __str__(self):
         ''' List cells, mines and group type
@@ -81,11 +119,16 @@ class AllGroups:
         # Frontier: list of cells that belong to at least ong group
         self.frontier = []
 
+        # Inverted index {cell: [positions in self.mine_groups]} of the
+        # groups containing each cell, in the order they were added
+        self.cell_index = {}
+
     def reset(self):
         ''' Clear the data of the groups
         '''
         self.hashes = set()
         self.mine_groups = []
+        self.cell_index = {}
         # For some reason result is 0.1% better if I don't reset count_groups
         # It does not make sene to me, I can't find why. But so be it.
         # self.count_groups = None
@@ -111,8 +154,28 @@ class AllGroups:
         If not, add to the list.
         '''
         if new_group.hash not in self.hashes:
+            position = len(self.mine_groups)
             self.mine_groups.append(new_group)
             self.hashes.add(new_group.hash)
+            for cell in new_group.cells:
+                self.cell_index.setdefault(cell, []).append(position)
+
+    def superset_candidates(self, group, exact_only=False):
+        ''' Iterator over the groups that can have all cells of "group":
+        the ones containing its least shared cell, in list order.
+        Groups added while iterating are included, like iterating self.
+        exact_only: only "exactly" groups (the first self.count_groups)
+        '''
+        # A group with no cells is in every group
+        if not group.cells:
+            positions = range(len(self.mine_groups))
+        else:
+            positions = min((self.cell_index[cell] for cell in group.cells),
+                            key=len)
+        for position in positions:
+            if exact_only and position >= self.count_groups:
+                return
+            yield self.mine_groups[position]
 
     def generate_frontier(self):
         ''' Populate self.frontier - list of cells belonging to any group
@@ -160,7 +223,8 @@ class AllGroups:
                 # Remove each cell and one mine - those  are your new subgroups
                 for cell in group.cells:
                     new_subgroup = MineGroup(group.cells.difference({cell}),
-                                             group.mines - 1, "at least")
+                                             group.mines - 1, "at least",
+                                             group.mask & ~cell_bit(cell))
                     # They will be added to the end of the list, so they
                     # in turn will be broken down, if needed
                     self.add_group(new_subgroup)
@@ -183,7 +247,8 @@ class AllGroups:
 
                 for cell in group.cells:
                     new_subgroup = MineGroup(group.cells.difference({cell}),
-                                             group.mines, "no more than")
+                                             group.mines, "no more than",
+                                             group.mask & ~cell_bit(cell))
                     self.add_group(new_subgroup)
 
     def __str__(self):
@@ -232,8 +297,9 @@ class GroupCluster:
     '''
 
     def __init__(self, group=None):
-        # Cells in the cluster (as a set)
+        # Cells in the cluster (as a set, and as a bitmask)
         self.cells_set = set()
+        self.mask = 0
         # List if groups in the cluster
         self.groups = []
 
@@ -246,16 +312,34 @@ class GroupCluster:
         # and list is needed to solve cluster.
         self.cells = []
 
-        # Placeholder for the solutions of this CSP
-        # (all valid sets of mines and safe cells)
-        # Positions corresponds to self.cells
-        self.solutions = []
+        # Cells that are in the same groups are interchangeable, so the
+        # cluster is solved for such classes of cells: how many mines are
+        # in each class. Class of each of self.cells, and size of each class
+        self.cell_classes = []
+        self.class_sizes = []
+
+        # Distinct numbers of mines in the solutions (in order of appearance),
+        # for each of them: how many solutions (of cells) have it, and how
+        # many mines there are in each class in all those solutions together
+        self.mine_counts = []
+        self.solution_counts = []
+        self.class_mines = []
+
+        # Solutions kept for the next move calculations: a matrix of mines
+        # in each class, one row per solution (of classes), how many
+        # solutions of cells each row stands for, and the position of
+        # its number of mines in self.mine_counts.
+        # None if the cluster wasn't solved
+        self.class_solutions = None
+        self.class_solution_counts = []
+        self.mine_count_index = None
 
         # Placeholder for the resulting frequencies of mines in each cell
         self.frequencies = {}
 
         # Placeholder for solution weight - how probable is this solution
-        # based on the number of mines in it
+        # based on the number of mines in it. One (exact) int for each
+        # of self.mine_counts, as the weight only depends on it
         self.solution_weights = []
 
         # Dict of possible mine counts {mines: mine_count, ...}
@@ -273,6 +357,7 @@ class GroupCluster:
         '''
         # Total list of cells in the cluster (union of all groups)
         self.cells_set = self.cells_set.union(group.cells)
+        self.mask |= group.mask
         # List of groups belonging to the cluster
         self.groups.append(group)
         # Mark the group that it has been used
@@ -281,98 +366,224 @@ class GroupCluster:
     def overlap(self, group):
         ''' Check if cells in group overlap with cells in the cluster.
         '''
-        return len(self.cells_set & group.cells) > 0
+        return self.mask & group.mask != 0
+
+    def order_cells(self):
+        ''' Order cells for the backtracking search: group by group, each
+        time the group sharing the most cells with the ones already placed.
+        That way groups get fully assigned (and checked) as early as possible.
+        '''
+        placed = set()
+        cells = []
+        groups_left = sorted(self.groups, key=lambda group: len(group.cells))
+        while groups_left:
+            best = max(groups_left,
+                       key=lambda group: (len(group.cells & placed),
+                                          -len(group.cells - placed)))
+            groups_left.remove(best)
+            for cell in sorted(best.cells - placed):
+                cells.append(cell)
+                placed.add(cell)
+        return cells
+
+    def split_classes(self):
+        ''' Populate self.cell_classes and self.class_sizes: cells that are
+        in exactly the same groups go to the same class (numbered in order
+        of self.cells). Return the list of groups of each class.
+        '''
+        cells_positions = {cell: pos for pos, cell in enumerate(self.cells)}
+        cell_groups = [[] for _ in self.cells]
+        for group_n, group in enumerate(self.groups):
+            for cell in group.cells:
+                cell_groups[cells_positions[cell]].append(group_n)
+
+        classes = {}
+        self.cell_classes = [classes.setdefault(tuple(groups), len(classes))
+                             for groups in cell_groups]
+        self.class_sizes = [0 for _ in classes]
+        for class_n in self.cell_classes:
+            self.class_sizes[class_n] += 1
+        return list(classes)
 
     def solve_cluster(self, remaining_mines):
         ''' Use CSP to find the solution to the CSP. Solution is the list of
         all possible mine/safe variations that fits all groups' condition.
-        Solution is in the form of a list of Tru/False (Tru for mine,
-        False for safe), with positions in the solution corresponding to cells
-        in self.cells list. Solution will be stored in self.solutions
-        Will result in empty solution if the initial cluster is too big.
-        '''
-        # for clusters with 1 group - there is not enough data to solve them
-        # if len(self.groups) == 1:
-        #     return
-
-        # It gets too slow and inefficient when
-        # - There are too many, but clusters but not enough groups
-        #    (cells/clusters > 12)
-        # - Long clusters (>40 cells)
-        # - Groups with too many possible mine positions (> 1001)
-        # Do not solve such clusters
-        if len(self.cells_set) / len(self.groups) > 12 or \
-           len(self.cells_set) > 50 or \
-           max(math.comb(len(group.cells), group.mines)
-                for group in self.groups if group.mines > 0) > 1001:
-            return
-
+        Cells in the same groups are interchangeable, so the solutions are
+        searched for the number of mines in each class of such cells:
+        one solution of classes stands for the product of comb(class size,
+        mines in class) solutions of cells.
+        Solutions are not stored one by one: for each number of mines we
+        add up the solutions and the mines in each class (self.mine_counts,
+        self.solution_counts, self.class_mines). Solutions of classes are
+        also kept, as a small int matrix, in self.class_solutions for
+        next_safe and mines_in_cells.
+        Will result in empty solution if there are more than
+        MAX_CLUSTER_SOLUTIONS solutions of classes.
+        Solved by depth-first backtracking over the ordered classes: each
+        assignment updates the groups of the class, and a group that has
+        all its mines (or only mines left, or one class left) forces the rest.
+        '''
         # We need to fix the order of cells, for that we populate self.cells
-        self.cells = list(self.cells_set)
-
-        # We also need a way to find a position of each cell by
-        # the cell itself. So here's the addressing dict
-        cells_positions = {cell: pos for pos, cell in enumerate(self.cells)}
-
-        # The list to put all the solutions in.
-        # Each "solution" is a list of [True, False, None, ...],
-        # corresponding to cluster's ordered cells,
-        # where True is a mine, False is safe and None is unknown
-        # It starts with all None and will be updated for each group
-        solutions = [[None for _ in range(len(self.cells))], ]
-
-        for group in self.groups:
-
-            # List of all possible ways mines can be placed in
-            # group's cells: for example: [(False, True, False), ...]
-            mine_positions = all_mines_positions(len(group.cells),
-                                                 group.mines)
-            # Now the same, but with cells as keys
-            # For example: {cell1: False, cell2: True, cell3: False}
-            mine_positions_dict = [dict(zip(group.cells, mine_position))
-                                   for mine_position in mine_positions]
-
-            # Failsafe: if there are more than 1_000_000 combinations
-            # to go through - pull the plug
-            if len(solutions) * len(mine_positions) > 1_000_000:
+        self.cells = self.order_cells()
+        class_groups = self.split_classes()
+        sizes = self.class_sizes
+
+        # For each group: its classes, mines still to place,
+        # cells and classes not assigned yet
+        members = [[] for _ in self.groups]
+        for class_n, groups in enumerate(class_groups):
+            for group_n in groups:
+                members[group_n].append(class_n)
+        need = [int(group.mines) for group in self.groups]
+        free = [len(group.cells) for group in self.groups]
+        left = [len(classes) for classes in members]
+
+        # Number of ways to put mines in a class: ways[class][mines]
+        ways = [[math.comb(size, mines) for mines in range(size + 1)]
+                for size in sizes]
+
+        # Current (partial) solution: mines in each class, None is unknown.
+        # Assigned classes go to the trail, to undo them
+        solution = [None for _ in sizes]
+        trail = []
+        placed_mines = 0
+
+        def forced_mines(group_n, class_n):
+            ''' Mines the group forces in the class, None if it doesn't
+            '''
+            if need[group_n] == 0:
+                return 0
+            if need[group_n] == free[group_n]:
+                return sizes[class_n]
+            if left[group_n] == 1:
+                return need[group_n]
+            return None
+
+        def assign(class_n, mines):
+            ''' Put mines in the class and set everything it forces.
+            Return False if it breaks a group or the remaining mines.
+            '''
+            nonlocal placed_mines
+            stack = [(class_n, mines)]
+            while stack:
+                class_n, mines = stack.pop()
+                if solution[class_n] is not None:
+                    if solution[class_n] != mines:
+                        return False
+                    continue
+                solution[class_n] = mines
+                trail.append(class_n)
+                placed_mines += mines
+                for group_n in class_groups[class_n]:
+                    free[group_n] -= sizes[class_n]
+                    need[group_n] -= mines
+                    left[group_n] -= 1
+                if placed_mines > remaining_mines:
+                    return False
+                for group_n in class_groups[class_n]:
+                    if need[group_n] < 0 or need[group_n] > free[group_n]:
+                        return False
+                    if left[group_n] == 0:
+                        continue
+                    for other in members[group_n]:
+                        if solution[other] is None:
+                            forced = forced_mines(group_n, other)
+                            if forced is None:
+                                break
+                            stack.append((other, forced))
+            return True
+
+        def undo(mark):
+            ''' Unassign everything after the trail position mark
+            '''
+            nonlocal placed_mines
+            while len(trail) > mark:
+                class_n = trail.pop()
+                mines = solution[class_n]
+                solution[class_n] = None
+                placed_mines -= mines
+                for group_n in class_groups[class_n]:
+                    free[group_n] += sizes[class_n]
+                    need[group_n] += mines
+                    left[group_n] += 1
+
+        # {mines: [solutions, mines in each class]}
+        totals = {}
+        found = 0
+        # Solutions of classes, SOLUTIONS_CHUNK of them in a matrix
+        kept_chunks = []
+        kept = []
+        kept_counts = []
+        kept_mines = []
+
+        def search(start):
+            ''' Try all numbers of mines in the next unknown class after start.
+            Return False when there are too many solutions.
+            '''
+            nonlocal found
+            for class_n in range(start, len(solution)):
+                if solution[class_n] is None:
+                    break
+            # Everything is assigned: this is a solution
+            else:
+                found += 1
+                if found > MAX_CLUSTER_SOLUTIONS:
+                    return False
+                solutions = 1
+                for class_n, mines in enumerate(solution):
+                    solutions *= ways[class_n][mines]
+                if placed_mines not in totals:
+                    totals[placed_mines] = [0, [0 for _ in sizes]]
+                total = totals[placed_mines]
+                total[0] += solutions
+                class_mines = total[1]
+                for class_n, mines in enumerate(solution):
+                    if mines:
+                        class_mines[class_n] += solutions * mines
+                kept.append(solution.copy())
+                kept_counts.append(solutions)
+                kept_mines.append(placed_mines)
+                if len(kept) == SOLUTIONS_CHUNK:
+                    kept_chunks.append(np.array(kept, dtype=np.int16))
+                    kept.clear()
+                return True
+            for mines in range(sizes[class_n] + 1):
+                mark = len(trail)
+                if assign(class_n, mines) and not search(class_n + 1):
+                    return False
+                undo(mark)
+            return True
+
+        # Groups that are decided from the start (0 mines, all mines
+        # or just one class)
+        for group_n, classes in enumerate(members):
+            if need[group_n] > free[group_n]:
                 return
+            for class_n in classes:
+                if solution[class_n] is not None:
+                    continue
+                forced = forced_mines(group_n, class_n)
+                if forced is None:
+                    break
+                if not assign(class_n, forced):
+                    return
+
+        # Too many solutions: leave the cluster unsolved
+        if not search(0):
+            return
 
-            # This is where will will put solutions,
-            # updated with current group's conditions
-            updated_solutions = []
-
-            # Go through each current solution and possible
-            # mine distribution in a group
-            for solution in solutions:
-                for mine_position in mine_positions_dict:
-
-                    updated_solution = solution.copy()
-
-                    # Check if this permutation fits with this solution
-                    for cell in group.cells:
-                        # This is the position of this cell in the solution
-                        position = cells_positions[cell]
-                        # If solution has nothing about this cell,
-                        # just update it with cell data
-                        if updated_solution[position] is None:
-                            updated_solution[position] = mine_position[cell]
-                        # But if there is already mine or safe in the solution:
-                        # it should be the same as in the permutation
-                        # If it isn't: break to the next permutation
-                        elif updated_solution[position] != mine_position[cell]:
-                            break
-                    # If we didn't break (solution and permutation fits),
-                    # Add it to the next round
-                    else:
-                        updated_solutions.append(updated_solution)
-
-            solutions = updated_solutions
-
-        # Check if there are no more mines in solutions than remaining mines
-        for solution in solutions:
-            mine_count = sum(1 for mine in solution if mine)
-            if mine_count <= remaining_mines:
-                self.solutions.append(solution)
+        self.mine_counts = list(totals)
+        self.solution_counts = [total[0] for total in totals.values()]
+        self.class_mines = [total[1] for total in totals.values()]
+        if found:
+            count_positions = {mines: position for position, mines
+                               in enumerate(self.mine_counts)}
+            kept_chunks.append(np.array(kept, dtype=np.int16).reshape(
+                len(kept), len(sizes)))
+            self.class_solutions = np.concatenate(kept_chunks)
+            self.class_solution_counts = kept_counts
+            self.mine_count_index = np.array(
+                [count_positions[mines] for mines in kept_mines], dtype=np.int64)
 
     def calculate_frequencies(self):
         ''' Once the solution is there, we can calculate frequencies:
@@ -383,21 +594,26 @@ class GroupCluster:
         cases this solution is likely to appear.
         '''
         # Can't do anything if there are no solutions
-        if not self.solutions:
+        if not self.mine_counts:
             return
 
-        for position, cell in enumerate(self.cells):
-            count_mines = 0
-            for solution_n, solution in enumerate(self.solutions):
-                # Mine count takes into account the weight of the solution
-                # So if fact it is 1 * weight
-                if solution[position]:
-                    count_mines += self.solution_weights[solution_n]
-            # Total in this case - not the number of solutions,
-            # but weight of all solutions
-            if sum(self.solution_weights) > 0:
-                self.frequencies[cell] = count_mines / \
-                    sum(self.solution_weights)
+        # Total in this case - not the number of solutions,
+        # but weight of all solutions
+        total_weight = sum(weight * count for weight, count
+                           in zip(self.solution_weights, self.solution_counts))
+
+        # Mines in each class, counted with the weight of the solutions.
+        # Cells of a class have the same share of its mines
+        class_weights = [
+            sum(weight * class_mines[class_n] for weight, class_mines
+                in zip(self.solution_weights, self.class_mines)) // size
+            for class_n, size in enumerate(self.class_sizes)]
+
+        for cell, class_n in zip(self.cells, self.cell_classes):
+            # Mine count takes into account the weight of the solution
+            # So if fact it is 1 * weight
+            if total_weight > 0:
+                self.frequencies[cell] = class_weights[class_n] / total_weight
             # This shouldn't normally happen, but it may rarely happen during
             # "next move" method, when "Uncovered but unknown" cell is added
             else:
@@ -407,36 +623,26 @@ class GroupCluster:
         ''' Populate self.next_safe, how many guaranteed safe cells
         will be there next move, after clicking this cell.
         '''
-        # Result will be here as {cell: next_safe_count}
-        next_safe = {}
-
-        # Go through all cells, we'll calculate next_safe for each
-        for next_cell_position, next_cell in enumerate(self.cells):
-            # Counter of next_safe
-            next_safe_counter = 0
-
-            # Go through all cells
-            for position, _ in enumerate(self.cells):
-                # Ignore itself (the cell we are counting the next_safe_for)
-                if position == next_cell_position:
-                    continue
-                # Now look at all solutions
-                for solution in self.solutions:
-                    # Skip the solutions where next_cell is a mine
-                    if solution[next_cell_position]:
-                        continue
-                    # If any solution has a mine in "position" -
-                    # it will not be safe in the next move
-                    if solution[position]:
-                        break
-                # But if you went through all solutions and all are safe:
-                # this is the a cell that will be safe next move
-                else:
-                    next_safe_counter += 1
-            # After looking at all positions we have the final count
-            next_safe[next_cell] = next_safe_counter
-
-        self.next_safe = next_safe
+        if self.class_solutions is None:
+            return
+        sizes = np.array(self.class_sizes)
+        # mine_if_safe[class, other]: solutions where class has a safe cell
+        # and other class has a mine. If there are none, the other class
+        # will be safe next move after clicking a cell of class.
+        # A chunk of solutions at a time, to keep the matrices small
+        # (float32 counts them exactly, and is much faster than ints)
+        mine_if_safe = np.zeros((len(sizes), len(sizes)), dtype=bool)
+        for start in range(0, len(self.class_solutions), SOLUTIONS_CHUNK):
+            chunk = self.class_solutions[start:start + SOLUTIONS_CHUNK]
+            can_be_safe = (chunk < sizes).astype(np.float32)
+            can_be_mine = (chunk > 0).astype(np.float32)
+            mine_if_safe |= (can_be_safe.T @ can_be_mine) > 0
+        safe_if_safe = ~mine_if_safe
+        # Not counting the cell itself (in its own class, if it is safe
+        # all the others are)
+        next_safe = (safe_if_safe @ sizes - np.diagonal(safe_if_safe)).tolist()
+        self.next_safe = {cell: next_safe[class_n] for cell, class_n
+                          in zip(self.cells, self.cell_classes)}
 
     def safe_cells(self):
         ''' Return list of guaranteed safe cells (0 in self.frequencies)
@@ -456,15 +662,13 @@ class GroupCluster:
         how many combinations of mines are possible with this solution.
         Populate self.solution_weights with the results
         '''
-        self.solution_weights = []
-
-        # For each solution we calculate how  many combination are possible
-        # with the remaining mines on the remaining cells
-        for solution in self.solutions:
-            solution_mines = sum(1 for mine in solution if mine)
-            solution_comb = math.comb(len(covered_cells) - len(solution),
-                                      remaining_mines - solution_mines)
-            self.solution_weights.append(solution_comb)
+        # For each number of mines in solutions we calculate how many
+        # combination are possible with the remaining mines
+        # on the remaining cells
+        self.solution_weights = [
+            math.comb(len(covered_cells) - len(self.cells),
+                      remaining_mines - solution_mines)
+            for solution_mines in self.mine_counts]
 
     def possible_mine_counts(self):
         ''' Based on solution and weights, calculate a dict with possible
@@ -474,13 +678,9 @@ class GroupCluster:
         '''
 
         # Cluster was solved
-        if self.solutions:
-            # Look at each solution
-            for solution in self.solutions:
-                mines_count = sum(1 for position in solution if position)
-                if mines_count not in self.probable_mines:
-                    self.probable_mines[mines_count] = 0
-                self.probable_mines[mines_count] += 1
+        if self.mine_counts:
+            self.probable_mines = dict(zip(self.mine_counts,
+                                           self.solution_counts))
             return
 
         # If cluster wasn't solved (which is basically never happens
@@ -508,22 +708,68 @@ class GroupCluster:
         '''
         # We need to calculate the dict of mine counts and their probability
         # like this: {0: 0.2, 1: 0.3, 2: 0.5}
+        if not self.mine_counts:
+            return {}
+
+        # How many of the cells to look at are in each class
+        looked_at = [0 for _ in self.class_sizes]
+        for cell, class_n in zip(self.cells, self.cell_classes):
+            if cell in cells_to_look_at:
+                looked_at[class_n] += 1
+        classes = [class_n for class_n, cells in enumerate(looked_at) if cells]
+
+        # Solutions with the same mines in those classes and the same
+        # number of mines (so the same weight) go together:
+        # each gets a key, mines in the classes and then the number of mines
+        keys = self.mine_count_index.copy()
+        for class_n in classes:
+            keys = keys * (self.class_sizes[class_n] + 1) + \
+                self.class_solutions[:, class_n]
+        keys, first, inverse = np.unique(keys, return_index=True,
+                                         return_inverse=True)
+        solutions_by_key = [0 for _ in keys]
+        for key_n, solutions in zip(inverse.tolist(),
+                                    self.class_solution_counts):
+            solutions_by_key[key_n] += solutions
+        # In order of appearance
+        order = np.argsort(first)
+        first = first[order]
+        solutions_by_key = [solutions_by_key[key_n] for key_n in order.tolist()]
+
+        # Weight of the solutions by mines in those classes, not counting
+        # the ways to put the mines there
+        by_mines = {}
+        for row, count_n, solutions in zip(
+                self.class_solutions[first][:, classes].tolist(),
+                self.mine_count_index[first].tolist(), solutions_by_key):
+            weight = solutions * self.solution_weights[count_n]
+            for class_n, mines in zip(classes, row):
+                weight //= math.comb(self.class_sizes[class_n], mines)
+            row = tuple(row)
+            by_mines[row] = by_mines.get(row, 0) + weight
+
+        # Split mines of each class between the cells to look at and the
+        # rest of the class, then accumulate weights for each mine count
         mine_counts = {}
-
-        # Go through all solution and their weights
-        for solution, weight in zip(self.solutions, self.solution_weights):
-
-            # Calculate mines in cells_to_look_at for each solution
-            mine_count = 0
-            for position, cell in enumerate(self.cells):
-                if cell in cells_to_look_at and solution[position]:
-                    mine_count += 1
-
-            # Accumulate weights for each mine count
-            mine_counts[mine_count] = mine_counts.get(mine_count, 0) + weight
+        for row, weight in by_mines.items():
+            counts = {0: weight}
+            for class_n, mines in zip(classes, row):
+                cells = looked_at[class_n]
+                others = self.class_sizes[class_n] - cells
+                updated_counts = {}
+                for already, count in counts.items():
+                    for in_cells in range(max(0, mines - others),
+                                          min(cells, mines) + 1):
+                        updated_counts[already + in_cells] = \
+                            updated_counts.get(already + in_cells, 0) + \
+                            count * math.comb(cells, in_cells) * \
+                            math.comb(others, mines - in_cells)
+                counts = updated_counts
+            for mines, count in counts.items():
+                mine_counts[mines] = mine_counts.get(mines, 0) + count
 
         # Normalize it (divide by total weights)
-        total_weights = sum(self.solution_weights)
+        total_weights = sum(mine_counts.values())
         mine_counts_normalized = {count: weight / total_weights
                                   for count, weight in mine_counts.items()}
 
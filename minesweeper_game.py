@@ -77,6 +77,9 @@ LEGEND = {**{
     CELL_EXPLODED_MINE: "!",
     0: "."
 }, **{i: str(i) for i in range(1, 81)}}
+# LEGEND as an array, LEGEND_TABLE[value - LEGEND_MIN]
+LEGEND_MIN = min(LEGEND)
+LEGEND_TABLE = np.array([LEGEND.get(i, "?") for i in range(LEGEND_MIN, max(LEGEND) + 1)])
 
 # MinesweeperGame.status: returned by the do_move, tells the result of the move
 STATUS_ALIVE = 0
@@ -231,13 +234,17 @@ class MinesweeperGame:
     accept a move, revealed the result, etc
     '''
 
-    def __init__(self, settings=GAME_BEGINNER, seed=None, field_str=None):
+    def __init__(self, settings=GAME_BEGINNER, seed=None, field_str=None,
+                 field=None, helper=None):
         ''' Initiate a new game: generate mines, calculate numbers.
         Inputs:
         - settings: GameSettings objects with dimensions of the game
                     an the number of mines
         - seed: Seed to use for generating board. None for random.
         - field_str: pre-generated board to use. String with "*" for mines
+        - field: pre-generated board with the numbers already calculated,
+                 used as is (see from_field)
+        - helper: MinesweeperHelper of this shape to share
         '''
 
         # Shape, a tuple of dimension sizes
@@ -257,21 +264,27 @@ class MinesweeperGame:
         if seed is not None:
             random.seed(seed)
 
-        self.helper = MinesweeperHelper(self.shape,
-                                        wrap_around=self.wrap_around)
+        if helper is None:
+            helper = MinesweeperHelper(self.shape,
+                                       wrap_around=self.wrap_around)
+        self.helper = helper
 
         # Now we initiate "field": array of mines and numbers that player
         # cannot see yet
 
-        # If field_str passed in - use it
-        if field_str is not None:
-            self.field = self.import_field(field_str)
-        # Otherwise, generate the field
+        # Ready field passed in: numbers are there already
+        if field is not None:
+            self.field = field
         else:
-            self.field = self.generate_mines()
+            # If field_str passed in - use it
+            if field_str is not None:
+                self.field = self.import_field(field_str)
+            # Otherwise, generate the field
+            else:
+                self.field = self.generate_mines()
 
-        # Populate it with numbers
-        self.generate_numbers()
+            # Populate it with numbers
+            self.generate_numbers()
 
         # Initiate "uncovered": the part of the field
         # that player sees
@@ -280,6 +293,20 @@ class MinesweeperGame:
         # Default status
         self.status = STATUS_ALIVE
 
+    @classmethod
+    def from_field(cls, field, uncovered=None, helper=None):
+        ''' Game from a field array (mines are CELL_MINE, other cells their
+        numbers), with no string parsing and no recount. Neither array is
+        copied. uncovered is what the player has opened so far (all covered
+        if None).
+        '''
+        settings = GameSettings(field.shape, int(np.count_nonzero(field == CELL_MINE)))
+        game = cls(settings, field=field, helper=helper)
+        if uncovered is not None:
+            game.uncovered = uncovered
+            game.remaining_mines -= int(np.count_nonzero(uncovered == CELL_MINE))
+        return game
+
     def generate_mines(self):
         '''Generate a game field (np array) with this size and mines
         according to the setting. Mines are marked as -1
@@ -670,23 +697,16 @@ class MinesweeperGame:
         # If no field passed in - use current game
         if field is None:
             field = self.field
-        field_str = ""
-        for cell in self.helper.iterate_over_all_cells():
-            field_str += LEGEND[self.field[cell]]
-        return field_str
+        # Same order as iterate_over_all_cells
+        return "".join(LEGEND_TABLE[np.ravel(field) - LEGEND_MIN])
 
     def import_field(self, field_str):
         '''Generate field from the string (that was saved by export)
         '''
-        field = np.full(self.shape, 0)
-        string_pointer = 0
-        # Go through all cells and all characters in the field_str
-        for cell in self.helper.iterate_over_all_cells():
-            # Whenever field_str has "*" - it's a mine
-            if field_str[string_pointer] == "*":
-                field[cell] = CELL_MINE
-            string_pointer += 1
-        return field
+        # Same order as iterate_over_all_cells
+        # Whenever field_str has "*" - it's a mine
+        chars = np.array(list(field_str[:np.prod(self.shape)]))
+        return np.where(chars == "*", CELL_MINE, 0).reshape(self.shape)
 
 
 def main():
@@ -1,10 +1,16 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import logging
 import numpy as np
-from random import shuffle, choice
-from copy import deepcopy
+from random import getrandbits
+from concurrent.futures import wait, FIRST_COMPLETED, BrokenExecutor
+from time import perf_counter
+from collections import namedtuple
 import minesweeper_game as mg
 from solver import MinesweeperSolver
+from telemetry import GenerationStats, SOURCE_CLICK, SOURCE_POOL, SOURCE_BACKGROUND
+
+logger = logging.getLogger('tgmsbot.mscore')
 
 # 0 - 8: means 0-8 mines, not opened
 # opened block = the value of not opened block + 10
@@ -19,7 +25,52 @@ from solver import MinesweeperSolver
 
 IS_MINE = 9
 DEAD = 20
+# solver runs for one map
 MAX_ATTEMPTS = 40
+# repair a guessy map by moving mines out of the frontier where the solver
+# got stuck, at most MAX_REPAIRS times before drawing a new one
+GEN_REPAIR = True
+MAX_REPAIRS = 8
+# build the map while solving it instead, see construct_layout,
+# with at most CONSTRUCT_STEPS moved mines between two verifications:
+# on boards with at least GEN_CONSTRUCT_DENSITY mines per block (None: never),
+# where repairing needs many more attempts, or on every board with GEN_CONSTRUCT
+GEN_CONSTRUCT = False
+GEN_CONSTRUCT_DENSITY = 0.22
+CONSTRUCT_STEPS = 64
+# drop maps with a visible forced guess before the solver sees them,
+# checking PREFILTER_BATCH random maps at a time
+PREFILTER = True
+PREFILTER_BATCH = 8
+
+# BoardPool with pre-generated guess-free layouts, set by the main module
+board_pool = None
+# corpus.Corpus of verified boards on disk, tried after board_pool, set by the main module
+corpus = None
+# Process pool for speculative map generation (a procpool.WorkerPool),
+# set by the main module.
+# SPECULATIVE_BATCH candidates are verified at the same time.
+executor = None
+# Process pool for generation nobody is waiting for (BoardPool refills,
+# continue_generation), so it never takes the room of a first click in executor.
+# Set by the main module, without it that work runs in the calling thread.
+background_executor = None
+SPECULATIVE_BATCH = 4
+
+default_rng = np.random.default_rng()
+# progress: blocks the solver has uncovered or flagged before it had to guess
+GenResult = namedtuple('GenResult', ['layout', 'guessfree', 'attempts', 'solver_time', 'progress'])
+# what Board.move changed: cells as (row, col), rows as a bitmask (bit n for row n)
+# and the state of the board afterwards
+MoveResult = namedtuple('MoveResult', ['cells', 'rows', 'state'])
+gen_stats = GenerationStats()
+# MinesweeperHelper (neighbours cache) of each board shape, shared by solvers
+solver_helpers = dict()
+
+AROUND = [(i, j) for i in (-1, 0, 1) for j in (-1, 0, 1) if (i, j) != (0, 0)]
+# (B - A, blocks next to only one of A and B relative to A), see prefilter_layouts
+PAIR_OFFSETS = [((i, j), sorted((set(AROUND) ^ {(k + i, l + j) for (k, l) in AROUND}) - {(0, 0), (i, j)}))
+                for i in range(-2, 3) for j in range(-2, 3) if (i, j) != (0, 0)]
 
 def check_params(height, width, mines):
     if height <= 0 or width <= 0:
@@ -40,6 +91,441 @@ def get_index(width, row_col):
     (row, col) = row_col
     index = width * row + col
     return index
+def count_neighbours(mine_mask):
+    '''
+        Build a map from a boolean mine mask, summing the shifted padded mask.
+        Works on a stack of masks too, the last two axes are the board.
+    '''
+    (height, width) = mine_mask.shape[-2:]
+    padding = [(0, 0)] * (mine_mask.ndim - 2) + [(1, 1), (1, 1)]
+    padded = np.pad(mine_mask, padding).astype(np.int8)
+    counts = np.zeros(mine_mask.shape, dtype=np.int8)
+    for i in range(3):
+        for j in range(3):
+            if i != 1 or j != 1:
+                counts += padded[..., i:i + height, j:j + width]
+    counts[mine_mask] = IS_MINE
+    return counts
+def allowed_cells(height, width, mines, first_move):
+    '''Flat indexes where a mine may be placed, see draw_layout'''
+    (row, col) = first_move
+    allowed = np.ones((height, width), dtype=bool)
+    allowed[row, col] = False
+    # first_move and its neighbours
+    zone = allowed[max(row - 1, 0):row + 2, max(col - 1, 0):col + 2]
+    if height * width - mines - 1 >= zone.size - 1:
+        zone[...] = False
+    return np.flatnonzero(allowed)
+def draw_layout(height, width, mines, first_move, rng=None):
+    '''A random map, first_move should't be a mine, and if possible, it should be an open.'''
+    if rng is None:
+        rng = default_rng
+    mine_mask = np.zeros(height * width, dtype=bool)
+    mine_mask[rng.choice(allowed_cells(height, width, mines, first_move), mines, replace=False)] = True
+    return count_neighbours(mine_mask.reshape(height, width))
+def draw_layouts(height, width, mines, first_move, count, rng=None):
+    '''count random maps at once like draw_layout, shape (count, height, width)'''
+    if rng is None:
+        rng = default_rng
+    cells = allowed_cells(height, width, mines, first_move)
+    picks = rng.random((count, len(cells))).argsort(axis=1)[:, :mines]
+    mine_mask = np.zeros((count, height * width), dtype=bool)
+    mine_mask[np.arange(count)[:, None], cells[picks]] = True
+    return count_neighbours(mine_mask.reshape(count, height, width))
+def prefilter_layouts(layouts, first_move):
+    '''
+        Cheap check of a stack of maps, False for the ones with a forced guess
+        in plain sight: a mine A and a safe block B (not first_move) such that
+        every block next to only one of them is a mine or off the board.
+        Nothing can tell A and B apart then, whatever else is opened.
+        True does not mean guess free, the solver has the final say.
+    '''
+    (height, width) = layouts.shape[-2:]
+    mines = layouts == IS_MINE
+    # off the board counts as a mine
+    # (the blocks around A and B are at most 3 steps from A)
+    padded = np.pad(mines, ((0, 0), (3, 3), (3, 3)), constant_values=True)
+    safe = np.pad(~mines, ((0, 0), (3, 3), (3, 3)), constant_values=False)
+    safe[:, first_move[0] + 3, first_move[1] + 3] = False
+    def shifted(array, offset):
+        return array[:, offset[0] + 3:offset[0] + 3 + height, offset[1] + 3:offset[1] + 3 + width]
+    # A and B far apart: both walled in by mines
+    walled = mines.copy()
+    walled_safe = shifted(safe, (0, 0)).copy()
+    for offset in AROUND:
+        walled &= shifted(padded, offset)
+        walled_safe &= shifted(padded, offset)
+    guessy = walled.any(axis=(1, 2)) & walled_safe.any(axis=(1, 2))
+    # A and B close enough to share neighbours
+    for (step, offsets) in PAIR_OFFSETS:
+        pair = mines & shifted(safe, step)
+        for offset in offsets:
+            pair &= shifted(padded, offset)
+        guessy |= pair.any(axis=(1, 2))
+    return ~guessy
+def draw_candidates(height, width, mines, first_move, rng=None, batch=None):
+    '''
+        Yield random maps batch at a time, skipping the ones prefilter_layouts
+        rejects. If a whole batch is rejected its first map is yielded anyway,
+        so the solver budget still bounds the search on dense boards.
+    '''
+    if batch is None:
+        batch = PREFILTER_BATCH if PREFILTER else 1
+    while True:
+        layouts = draw_layouts(height, width, mines, first_move, batch, rng=rng)
+        if PREFILTER:
+            keep = prefilter_layouts(layouts, first_move)
+            if not keep.any():
+                keep[0] = True
+            layouts = layouts[keep]
+        yield from layouts
+def solve_layout(layout, first_move):
+    '''
+        Check if the game is guess free.
+        Returns (guessfree, uncovered), uncovered is what the solver
+        has uncovered when it stopped, mines are mg.CELL_MINE and
+        covered blocks are mg.CELL_COVERED.
+    '''
+    (game, solver) = start_game(layout, first_move)
+    guessfree = solver.is_game_deterministic(game)
+    return (guessfree, game.uncovered)
+def opening_mask(layout, row_col):
+    '''Blocks opened by clicking row_col: the block, and its whole opening if it is a 0'''
+    (height, width) = layout.shape
+    region = np.zeros((height, width), dtype=bool)
+    region[tuple(row_col)] = True
+    if layout[tuple(row_col)] != 0:
+        return region
+    zero = layout == 0
+    while True:
+        padded = np.pad(region & zero, 1)
+        grown = region.copy()
+        for i in range(3):
+            for j in range(3):
+                grown |= padded[i:i + height, j:j + width]
+        if np.array_equal(grown, region):
+            return region
+        region = grown
+def label_regions(mask):
+    '''
+        Connected components of mask, blocks touching by a side or a corner.
+        Returns (labels, count), labels counting from 1 and 0 outside mask.
+    '''
+    (height, width) = mask.shape
+    labels = np.where(mask, np.arange(1, height * width + 1).reshape(height, width), 0)
+    # spread the largest index over each component
+    while True:
+        padded = np.pad(labels, 1)
+        grown = labels.copy()
+        for i in range(3):
+            for j in range(3):
+                np.maximum(grown, padded[i:i + height, j:j + width], out=grown)
+        grown[~mask] = 0
+        if np.array_equal(grown, labels):
+            break
+        labels = grown
+    ids = np.unique(labels[mask])
+    renumber = np.zeros(height * width + 1, dtype=np.int16)
+    renumber[ids] = np.arange(1, len(ids) + 1)
+    return (renumber[labels], len(ids))
+def label_openings(layout):
+    '''
+        Returns (labels, openings). labels[row, col] is the opening (connected
+        0 blocks) a 0 block belongs to, counting from 1, and 0 for other blocks.
+        openings[label - 1] are the flat indexes of that opening and the numbers
+        around it, all that clicking one of its 0 blocks opens.
+    '''
+    (height, width) = layout.shape
+    (labels, count) = label_regions(layout == 0)
+    openings = list()
+    for label in range(1, count + 1):
+        padded = np.pad(labels == label, 1)
+        region = np.zeros((height, width), dtype=bool)
+        for i in range(3):
+            for j in range(3):
+                region |= padded[i:i + height, j:j + width]
+        openings.append(np.flatnonzero(region))
+    return (labels, openings)
+def layout_statistics(layout, openings=None):
+    '''
+        (op, is, 3bv) of a layout: the openings, the islands of numbers
+        outside them, and the clicks needed to open every safe block.
+        openings: from label_openings(layout), if already known.
+    '''
+    if openings is None:
+        (_, openings) = label_openings(layout)
+    bordered = np.zeros(layout.size, dtype=bool)
+    for region in openings:
+        bordered[region] = True
+    lonely = (layout >= 1) & (layout <= 8) & ~bordered.reshape(layout.shape)
+    (_, s_is) = label_regions(lonely)
+    s_op = len(openings)
+    return (s_op, s_is, s_op + int(np.count_nonzero(lonely)))
+def start_game(layout, first_move):
+    '''
+        A solver game of the layout with first_move opened, and its solver.
+        The game has the same shape and (row, col) cells as the layout.
+    '''
+    field = np.where(layout == IS_MINE, mg.CELL_MINE, layout)
+    uncovered = np.where(opening_mask(layout, first_move), field, mg.CELL_COVERED)
+    helper = solver_helpers.get(layout.shape)
+    if helper is None:
+        helper = solver_helpers[layout.shape] = mg.MinesweeperHelper(layout.shape)
+    game = mg.MinesweeperGame.from_field(field, uncovered=uncovered, helper=helper)
+    settings = mg.GameSettings(layout.shape, game.mines)
+    solver = MinesweeperSolver(settings, helper=helper)
+    return (game, solver)
+def verify_layout(layout, first_move):
+    '''Check if the game is guess free'''
+    return solve_layout(layout, first_move)[0]
+def repair_layout(layout, uncovered, rng=None):
+    '''
+        Move one mine out of the unresolved frontier where the solver got stuck,
+        to a covered block away from it (or elsewhere on the frontier if there
+        is no room). Returns None if there is nothing to move.
+    '''
+    if rng is None:
+        rng = default_rng
+    covered = uncovered == mg.CELL_COVERED
+    revealed = np.pad(uncovered >= 0, 1)
+    (height, width) = layout.shape
+    near_revealed = np.zeros((height, width), dtype=bool)
+    for i in range(3):
+        for j in range(3):
+            near_revealed |= revealed[i:i + height, j:j + width]
+    mine_mask = layout == IS_MINE
+    frontier = covered & near_revealed
+    sources = np.flatnonzero(frontier & mine_mask)
+    targets = np.flatnonzero(covered & ~near_revealed & ~mine_mask)
+    if len(targets) == 0:
+        targets = np.flatnonzero(frontier & ~mine_mask)
+    if len(sources) == 0 or len(targets) == 0:
+        return None
+    mine_mask = mine_mask.reshape(-1)
+    mine_mask[rng.choice(sources)] = False
+    mine_mask[rng.choice(targets)] = True
+    return count_neighbours(mine_mask.reshape(height, width))
+def perturb_layout(layout, uncovered, rng=None):
+    '''
+        Flip one block of the unresolved frontier where the solver got stuck,
+        swapping it with a covered block away from the frontier: a mine there
+        is cleared, a safe block gets a mine. Returns None if there is no room.
+    '''
+    if rng is None:
+        rng = default_rng
+    covered = uncovered == mg.CELL_COVERED
+    revealed = np.pad(uncovered >= 0, 1)
+    (height, width) = layout.shape
+    near_revealed = np.zeros((height, width), dtype=bool)
+    for i in range(3):
+        for j in range(3):
+            near_revealed |= revealed[i:i + height, j:j + width]
+    mine_mask = (layout == IS_MINE).reshape(-1)
+    frontier = np.flatnonzero(covered & near_revealed)
+    interior = np.flatnonzero(covered & ~near_revealed)
+    for block in rng.permutation(frontier):
+        others = interior[mine_mask[interior] != mine_mask[block]]
+        if len(others):
+            other = rng.choice(others)
+            (mine_mask[block], mine_mask[other]) = (mine_mask[other], mine_mask[block])
+            return count_neighbours(mine_mask.reshape(height, width))
+    return None
+def find_layout(height, width, mines, first_move, budget, repairs=MAX_REPAIRS, rng=None,
+                deadline=None):
+    '''
+        Draw layouts until one is guess free, repairing each guessy layout
+        up to repairs times before drawing a new one.
+        Verifies at most budget layouts and stops early at deadline (perf_counter).
+        If none is guess free, the one the solver got furthest on is returned.
+    '''
+    candidates = draw_candidates(height, width, mines, first_move, rng=rng)
+    layout = next(candidates)
+    repaired = 0
+    solver_time = 0.0
+    best = None
+    for verifications in range(1, budget + 1):
+        solver_start = perf_counter()
+        (guessfree, uncovered) = solve_layout(layout, first_move)
+        solver_time += perf_counter() - solver_start
+        if guessfree:
+            return GenResult(layout, True, verifications, solver_time, layout.size)
+        progress = int(np.count_nonzero(uncovered != mg.CELL_COVERED))
+        if best is None or progress > best[1]:
+            best = (layout, progress)
+        if verifications == budget or (deadline is not None and perf_counter() >= deadline):
+            break
+        new_layout = None
+        if repaired < repairs:
+            new_layout = repair_layout(layout, uncovered, rng=rng)
+        if new_layout is None:
+            layout = next(candidates)
+            repaired = 0
+        else:
+            layout = new_layout
+            repaired += 1
+    return GenResult(best[0], False, verifications, solver_time, best[1])
+def construct_layout(height, width, mines, first_move, budget, steps=None, rng=None,
+                     deadline=None):
+    '''
+        Build a guess-free layout while solving it: wherever the solver gets
+        stuck, move a mine out of the stuck frontier (see repair_layout),
+        update the numbers already opened and go on solving the same game.
+        Each pass of at most steps moves ends with a full verification
+        from the first move, since earlier deductions used the old numbers.
+        Verifies at most budget layouts, same result as find_layout.
+    '''
+    if steps is None:
+        steps = CONSTRUCT_STEPS
+    candidates = draw_candidates(height, width, mines, first_move, rng=rng)
+    layout = next(candidates)
+    solver_time = 0.0
+    best = None
+    for verifications in range(1, budget + 1):
+        solver_start = perf_counter()
+        (game, solver) = start_game(layout, first_move)
+        if solver.is_game_deterministic(game):
+            solver_time += perf_counter() - solver_start
+            return GenResult(layout, True, verifications, solver_time, layout.size)
+        progress = int(np.count_nonzero(game.uncovered != mg.CELL_COVERED))
+        if best is None or progress > best[1]:
+            best = (layout, progress)
+        if verifications == budget:
+            break
+        for _ in range(steps):
+            layout = perturb_layout(np.where(game.field == mg.CELL_MINE, IS_MINE, 0),
+                                    game.uncovered, rng=rng)
+            if layout is None:
+                break
+            field = np.where(layout == IS_MINE, mg.CELL_MINE, layout)
+            game.field = field
+            opened = game.uncovered >= 0
+            game.uncovered[opened] = field[opened]
+            if solver.is_game_deterministic(game, resume=True):
+                break
+        solver_time += perf_counter() - solver_start
+        if deadline is not None and perf_counter() >= deadline:
+            break
+        if layout is None:
+            # nothing left to move, start over
+            layout = next(candidates)
+    return GenResult(best[0], False, verifications, solver_time, best[1])
+def try_layout(height, width, mines, first_move, seed, repairs, deadline=None, construct=False):
+    '''One generation attempt (with its repairs), runs in a worker process'''
+    # perf_counter is system-wide monotonic, the deadline holds across processes
+    if construct:
+        return construct_layout(height, width, mines, first_move, repairs + 1,
+                                rng=np.random.default_rng(seed), deadline=deadline)
+    return find_layout(height, width, mines, first_move, repairs + 1, repairs=repairs,
+                       rng=np.random.default_rng(seed), deadline=deadline)
+def gen_layout_local(height, width, mines, first_move, budget, repairs, deadline=None,
+                     construct=False):
+    '''Generate a layout in this process, see find_layout'''
+    if construct:
+        return construct_layout(height, width, mines, first_move, budget, deadline=deadline)
+    return find_layout(height, width, mines, first_move, budget, repairs=repairs,
+                       deadline=deadline)
+def gen_layout_parallel(pool, height, width, mines, first_move, budget, repairs, deadline=None,
+                        construct=False):
+    '''
+        Keep SPECULATIVE_BATCH attempts (at most one per process) running on
+        pool, a procpool.WorkerPool, take the first guess-free layout and cancel the rest.
+        Same arguments and result as find_layout, but if there is no result
+        at all by the deadline (say the pool is busy), a random layout
+        is returned, with the attempts not spent left for continue_generation.
+        A broken pool falls back to gen_layout_local.
+    '''
+    # future -> verifications reserved for it (its repairs + 1)
+    futures = dict()
+    verifications = 0
+    solver_time = 0.0
+    best = None
+    batch = min(SPECULATIVE_BATCH, pool.processes)
+    def submit():
+        '''Start one more attempt if the budget has room for it'''
+        allowed = min(repairs + 1, budget - verifications - sum(futures.values()))
+        if allowed <= 0 or len(futures) >= batch:
+            return False
+        task = (try_layout, height, width, mines, first_move, getrandbits(64),
+                allowed - 1, deadline, construct)
+        if deadline is None:
+            future = pool.submit(*task)
+        else:
+            # the queue may be full, wait for room only until the deadline
+            future = pool.try_submit(deadline - perf_counter(), *task)
+            if future is None:
+                return False
+        futures[future] = allowed
+        return True
+    try:
+        while submit():
+            pass
+        while futures:
+            timeout = None if deadline is None else max(deadline - perf_counter(), 0)
+            (done, _) = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                del futures[future]
+                result = future.result()
+                verifications += result.attempts
+                solver_time += result.solver_time
+                if result.guessfree:
+                    return result._replace(attempts=verifications, solver_time=solver_time)
+                if best is None or result.progress > best.progress:
+                    best = result
+            while submit():
+                pass
+            if deadline is not None and perf_counter() >= deadline:
+                break
+        if best is None:
+            return GenResult(draw_layout(height, width, mines, first_move), False,
+                             verifications, solver_time, 0)
+        return best._replace(attempts=verifications, solver_time=solver_time)
+    except BrokenExecutor as e:
+        logger.warning(f'Generation pool is broken ({e}), generating in this process')
+        result = gen_layout_local(height, width, mines, first_move,
+                                  max(budget - verifications, 1), repairs,
+                                  deadline=deadline, construct=construct)
+        return result._replace(attempts=verifications + result.attempts,
+                               solver_time=solver_time + result.solver_time)
+    finally:
+        for future in futures:
+            future.cancel()
+def gen_layout(height, width, mines, first_move, budget=MAX_ATTEMPTS, deadline=None,
+               background=False):
+    '''
+        Generate a layout with the current settings, see find_layout.
+        background: nobody is waiting for it, use background_executor.
+    '''
+    repairs = MAX_REPAIRS if GEN_REPAIR else 0
+    construct = GEN_CONSTRUCT or (GEN_CONSTRUCT_DENSITY is not None and
+                                  mines >= GEN_CONSTRUCT_DENSITY * height * width)
+    pool = background_executor if background else executor
+    if mines == 0:
+        return GenResult(draw_layout(height, width, mines, first_move), True, 0, 0.0,
+                         height * width)
+    elif pool is not None:
+        return gen_layout_parallel(pool, height, width, mines, first_move, budget, repairs,
+                                   deadline=deadline, construct=construct)
+    else:
+        return gen_layout_local(height, width, mines, first_move, budget, repairs,
+                                deadline=deadline, construct=construct)
+def gen_recorded(height, width, mines, first_move, budget=MAX_ATTEMPTS, deadline=None,
+                 source=SOURCE_CLICK):
+    '''gen_layout, recorded in gen_stats under source. Returns (GenResult, seconds used)'''
+    gen_start = perf_counter()
+    result = gen_layout(height, width, mines, first_move, budget=budget, deadline=deadline,
+                        background=source != SOURCE_CLICK)
+    gen_time = perf_counter() - gen_start
+    gen_stats.record(height, width, mines, result.attempts, result.guessfree,
+                     result.solver_time, gen_time, source=source)
+    return (result, gen_time)
+def ready_layout(height, width, mines, first_move):
+    '''A guess-free layout from board_pool or corpus, None if there is none'''
+    layout = None
+    if board_pool is not None:
+        layout = board_pool.take(height, width, mines, first_move)
+    if layout is None and corpus is not None:
+        layout = corpus.take(height, width, mines, first_move)
+    return layout
 class Board():
     def __init__(self, height, width, mines):
         self.height = height
@@ -50,11 +536,28 @@ class Board():
         self.moves = list()
         self.state = 0 # 0:not playing, 1:playing, 2:win, 3:dead
         self.guessfree = False
-        # statistics
-        self.__op = 0
-        self.__is = 0
-        self.__3bv = 0
-    def __gen_map(self, first_move, attempts=0):
+        # solver runs and seconds used by map generation, 0 for a pre-generated map
+        self.gen_attempts = 0
+        self.gen_time = 0.0
+        # attempts left when generation was cut short by the time budget,
+        # see continue_generation()
+        self.pending_attempts = 0
+        # map is shared with a BoardTemplate until the first move here
+        self.shared = False
+        # made by from_template, the same map is played in other games
+        self.templated = False
+        # unopened blocks without a mine, and flagged or stepped mines,
+        # kept up to date by __reveal and __open
+        self.unopened = 0
+        self.mines_opened = 0
+        # flat indexes of the blocks changed by the current move
+        self.__changed = list()
+        # see label_openings
+        self.__labels = None
+        self.__openings = None
+        # (op, is, 3bv), see layout_statistics
+        self.__statistics = None
+    def __gen_map(self, first_move, deadline=None, source=SOURCE_CLICK):
         height = self.height
         width = self.width
         mines = self.mines
@@ -62,53 +565,14 @@ class Board():
             return
         elif mines < 0:
             return
-        # first_move should't be a mine, and if possible, it should be an open.
-        self.map = np.zeros((height, width), dtype=np.int8)
-        map_1d = [IS_MINE] * mines
-        zero_blocks = list()
-        fm_index = get_index(width, first_move)
-        zero_blocks.append(fm_index)
-        fm_nbrs = [rc for rc in self.__iter_neighbour(*first_move)]
-        if height * width - mines - 1 >= len(fm_nbrs):
-            fm_nbrs_index = [get_index(width, fm_nbr) for fm_nbr in fm_nbrs]
-            zero_blocks += fm_nbrs_index
-            map_1d += [0] * (height * width - mines - 1 - len(fm_nbrs))
-        else:
-            map_1d += [0] * (height * width - mines - 1)
-        shuffle(map_1d)
-        for mindex in sorted(zero_blocks):
-            map_1d.insert(mindex, 0)
-        for mindex in range(len(map_1d)):
-            if map_1d[mindex] == IS_MINE:
-                (row, col) = get_row_col(width, mindex)
-                self.map[row][col] = IS_MINE
-        for row in range(height):
-            for col in range(width):
-                if self.map[row][col] != IS_MINE:
-                    mine_count = 0
-                    for nbr_value in self.__iter_neighbour(row, col, return_rc=False):
-                        if nbr_value == IS_MINE:
-                            mine_count += 1
-                    self.map[row][col] = mine_count
-        # Check if game is guess free
-        if mines == 0:
-            self.mmap = deepcopy(self.map)
-            self.guessfree = True
-            return
-        if attempts >= MAX_ATTEMPTS:
-            self.mmap = deepcopy(self.map)
-            return
-        settings = mg.GameSettings((width, height), mines)
-        # Note that the index used by solver is weird
-        game = mg.MinesweeperGame(settings,
-            field_str=''.join(['.' if self.map[j][i] != IS_MINE else '*' for i in range(width) for j in range(height)]))
-        game.handle_safe_click((first_move[1], first_move[0]))
-        solver = MinesweeperSolver(settings)
-        if solver.is_game_deterministic(game):
-            self.mmap = deepcopy(self.map)
-            self.guessfree = True
-            return
-        self.__gen_map(first_move, attempts + 1)
+        (result, self.gen_time) = gen_recorded(height, width, mines, first_move,
+                                               deadline=deadline, source=source)
+        self.__set_layout(result.layout)
+        self.guessfree = result.guessfree
+        self.gen_attempts = result.attempts
+        # left when stopped by the deadline
+        self.pending_attempts = 0 if result.guessfree else \
+            max(0, MAX_ATTEMPTS - result.attempts)
     def __iter_neighbour(self, row, col, return_rc=True):
         height = self.height
         width = self.width
@@ -121,37 +585,39 @@ class Board():
                     else:
                         yield self.map[row + i][col + j]
     def __do_i_win(self):
-        self.unopened = 0
-        self.mines_opened = 0
-        for x in np.nditer(self.map):
-            if x <= 8:
-                self.unopened += 1
-            elif x in (19, DEAD):
-                self.mines_opened += 1
-        if self.mines_opened == self.mines:
-            return True
-        elif self.unopened == 0:
-            return True
-        else:
-            return False
-    def __open(self, row, col, automatic=False):
+        return self.mines_opened == self.mines or self.unopened == 0
+    def __reveal(self, row, col):
+        '''Open an unopened block for the player, mines get flagged'''
+        value = self.map[row][col]
+        if value == 0:
+            # the whole opening at once
+            cells = self.map.reshape(-1)
+            region = self.__openings[self.__labels[row][col] - 1]
+            opened = cells[region]
+            unopened = opened <= 9
+            cells[region] = np.where(unopened, opened + 10, opened)
+            # no mines in an opening
+            self.unopened -= int(np.count_nonzero(unopened))
+            self.__changed.extend(region[unopened].tolist())
+        elif value <= 8:
+            self.map[row][col] += 10
+            self.unopened -= 1
+            self.__changed.append(row * self.width + col)
+        elif value == 9:
+            self.map[row][col] += 10
+            self.mines_opened += 1
+            self.__changed.append(row * self.width + col)
+    def __open(self, row, col):
         if self.state != 1:
             return
-        if not automatic and self.map[row][col] == 9:
+        if self.map[row][col] == 9:
             self.map[row][col] = DEAD
             self.state = 3
-            # update opened mines count
-            self.__do_i_win()
+            self.mines_opened += 1
+            self.__changed.append(row * self.width + col)
             return
-        elif self.map[row][col] == 0:
-            self.map[row][col] += 10 # open this block
-            # open other blocks
-            for nbr in self.__iter_neighbour(row, col):
-                self.__open(nbr[0], nbr[1], automatic=True)
         elif self.map[row][col] >= 10:
             # already opened
-            if automatic:
-                return
             neighbour_mine_opened = 0
             neighbour_unopened = 0
             for neighbour in self.__iter_neighbour(row, col, return_rc=False):
@@ -162,53 +628,152 @@ class Board():
             if (neighbour_mine_opened == self.map[row][col] - 10) or \
             (neighbour_unopened == self.map[row][col] - 10 - neighbour_mine_opened):
                 for nbr in self.__iter_neighbour(row, col):
-                    self.__open(nbr[0], nbr[1], automatic=True)
+                    self.__reveal(nbr[0], nbr[1])
         else:
-            self.map[row][col] += 10
+            self.__reveal(row, col)
         if self.__do_i_win():
             self.state = 2
+    def __set_layout(self, layout):
+        self.map = layout.copy()
+        self.mmap = layout.copy()
+        self.unopened = int(np.count_nonzero(layout <= 8))
+        self.mines_opened = 0
+        (self.__labels, self.__openings) = label_openings(layout)
+        self.__statistics = layout_statistics(layout, self.__openings)
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # pickled before openings were labelled
+        if '_Board__labels' not in state and self.mmap is not None:
+            (self.__labels, self.__openings) = label_openings(self.mmap)
+        # pickled before statistics were kept
+        if '_Board__statistics' not in state:
+            for name in ('_Board__op', '_Board__is', '_Board__3bv', '_Board__visited'):
+                self.__dict__.pop(name, None)
+            self.__statistics = None
+            if self.mmap is not None:
+                self.__statistics = layout_statistics(self.mmap, self.__openings)
+    def get_openings(self):
+        '''(labels, openings) of the layout, see label_openings'''
+        return (self.__labels, self.__openings)
+
+    def generate(self, first_move):
+        '''Generate the map for first_move without opening anything, for the pool'''
+        self.__gen_map(first_move, source=SOURCE_POOL)
+    def load(self, layout, guessfree=True):
+        '''Use a pre-generated layout instead of generating one'''
+        self.__set_layout(layout)
+        self.guessfree = guessfree
+        self.pending_attempts = 0
 
-    def move(self, row_col):
+    def move(self, row_col, budget=None):
+        '''
+            budget: seconds the first move may spend on generation,
+            the best map so far is used once it runs out.
+        '''
         if self.state == 0:
-            self.__gen_map(row_col)
+            layout = ready_layout(self.height, self.width, self.mines, row_col)
+            if layout is not None:
+                self.load(layout)
+            else:
+                self.__gen_map(row_col, deadline=None if budget is None
+                                                 else perf_counter() + budget)
             self.state = 1
+        if getattr(self, 'shared', False):
+            self.map = self.map.copy()
+            self.shared = False
+        self.moves.append(tuple(row_col))
         (row, col) = row_col
+        self.__changed = list()
         self.__open(row, col)
+        return self.__move_result()
+
+    def __move_result(self):
+        changed = sorted(set(self.__changed))
+        self.__changed = list()
+        rows = 0
+        for index in changed:
+            rows |= 1 << (index // self.width)
+        return MoveResult([get_row_col(self.width, index) for index in changed], rows, self.state)
+
+    @classmethod
+    def from_template(cls, template):
+        '''A board playing template, with its first move already opened'''
+        board = cls(template.height, template.width, template.mines)
+        board.map = template.start
+        board.mmap = template.mmap
+        board.shared = True
+        board.templated = True
+        board.guessfree = template.guessfree
+        board.state = template.state
+        board.moves = [template.first_move]
+        board.unopened = template.unopened
+        board.mines_opened = template.mines_opened
+        (board.__labels, board.__openings) = template.openings
+        board.__statistics = template.statistics
+        return board
+
+    def continue_generation(self):
+        '''
+            Spend the attempts left after the first move ran out of time,
+            without touching the board. Returns a guess-free layout or None.
+        '''
+        (attempts, self.pending_attempts) = (self.pending_attempts, 0)
+        if attempts <= 0 or not self.moves:
+            return None
+        (result, _) = gen_recorded(self.height, self.width, self.mines, self.moves[0],
+                                   budget=attempts, source=SOURCE_BACKGROUND)
+        return result.layout if result.guessfree else None
+
+    def swap_layout(self, layout):
+        '''
+            Replace the map with a guess-free one, as long as nothing
+            has happened since the first move. Returns True on success,
+            the whole map may have changed then.
+        '''
+        if self.state != 1 or len(self.moves) != 1:
+            return False
+        self.load(layout)
+        (row, col) = self.moves[0]
+        self.__open(row, col)
+        self.__changed = list()
+        return True
 
     def gen_statistics(self):
-        if self.__3bv != 0:
-            return (self.__op, self.__is, self.__3bv)
-        self.__visited = np.zeros((self.height, self.width), dtype=np.int8)
-        def scan_open(row, col):
-            self.__visited[row][col] = 1
-            for nbr_rc in self.__iter_neighbour(row, col):
-                (nrow, ncol) = nbr_rc
-                if self.__visited[nrow][ncol] == 0:
-                    nbr = self.mmap[nrow][ncol]
-                    if nbr == 0:
-                        scan_open(nrow, ncol)
-                    elif nbr <= 8:
-                        self.__visited[nrow][ncol] = 1
-        def scan_island(row, col):
-            self.__3bv += 1
-            self.__visited[row, col] = 1
-            for nbr_rc in self.__iter_neighbour(row, col):
-                (nrow, ncol) = nbr_rc
-                if self.__visited[nrow][ncol] == 0:
-                    nbr = self.mmap[nrow][ncol]
-                    if nbr >= 1 and nbr <= 8:
-                        scan_island(nrow, ncol)
-
-        for row in range(self.height):
-            for col in range(self.width):
-                if self.__visited[row][col] == 0 and self.mmap[row][col] == 0:
-                    self.__op += 1
-                    self.__3bv += 1
-                    scan_open(row, col)
-        for row in range(self.height):
-            for col in range(self.width):
-                cell = self.mmap[row][col]
-                if self.__visited[row][col] == 0 and cell >= 1 and cell <= 8:
-                    self.__is += 1
-                    scan_island(row, col)
-        return (self.__op, self.__is, self.__3bv)
+        '''(op, is, 3bv) of the map, worked out when it was set'''
+        return self.__statistics
+
+class BoardTemplate():
+    '''
+        One board played in many games at once (daily challenge, races).
+        The layout and the map with first_move opened are made once, read-only,
+        every Board.from_template shares them until its own first move.
+    '''
+    def __init__(self, layout, first_move, guessfree=True):
+        (self.height, self.width) = layout.shape
+        self.mines = int(np.count_nonzero(layout == IS_MINE))
+        self.first_move = tuple(first_move)
+        self.guessfree = guessfree
+        board = Board(self.height, self.width, self.mines)
+        board.load(layout, guessfree=guessfree)
+        board.state = 1
+        board.move(self.first_move)
+        self.state = board.state
+        self.unopened = board.unopened
+        self.mines_opened = board.mines_opened
+        self.statistics = board.gen_statistics()
+        self.openings = board.get_openings()
+        self.mmap = board.mmap
+        self.start = board.map
+        self.mmap.flags.writeable = False
+        self.start.flags.writeable = False
+    @classmethod
+    def generate(cls, height, width, mines, first_move=None, rng=None):
+        '''
+            first_move defaults to the centre. Generated in this process,
+            so the same rng seed always gives the same template.
+        '''
+        if first_move is None:
+            first_move = (height // 2, width // 2)
+        result = find_layout(height, width, mines, first_move, MAX_ATTEMPTS,
+                             repairs=MAX_REPAIRS if GEN_REPAIR else 0, rng=rng)
+        return cls(result.layout, first_move, guessfree=result.guessfree)
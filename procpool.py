@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from concurrent.futures import ProcessPoolExecutor
+from threading import BoundedSemaphore, Lock
+import multiprocessing
+
+class WorkerPool:
+    '''
+        Process pool for cpu-bound work (map generation, solving),
+        so it does not hold the GIL of the bot process.
+        At most max_pending tasks are queued or running, submit() blocks
+        until there is room, so a burst of slow boards can not pile up
+        an unbounded backlog behind the other chats.
+    '''
+    def __init__(self, processes, max_pending=None):
+        assert processes > 0
+        self.processes = processes
+        self.max_pending = max_pending or processes * 2
+        # fork the workers now, create the pool before any other thread is started
+        self.__executor = ProcessPoolExecutor(max_workers=processes,
+                                              mp_context=multiprocessing.get_context('fork'))
+        self.__executor.submit(int).result()
+        self.__slots = BoundedSemaphore(self.max_pending)
+        self.__lock = Lock()
+        # counters
+        self.pending = 0
+        self.completed = 0
+        self.waited = 0
+
+    def __done(self, future):
+        with self.__lock:
+            self.pending -= 1
+            self.completed += 1
+        self.__slots.release()
+
+    def submit(self, fn, *args, **kwargs):
+        '''Same as Executor.submit, waits while max_pending tasks are in the queue'''
+        return self.try_submit(None, fn, *args, **kwargs)
+
+    def try_submit(self, timeout, fn, *args, **kwargs):
+        '''
+            Same as submit, but waits at most timeout seconds for room in the queue
+            (None: as long as it takes). Returns None if there was no room in time.
+        '''
+        if not self.__slots.acquire(blocking=False):
+            with self.__lock:
+                self.waited += 1
+            if not self.__slots.acquire(timeout=None if timeout is None else max(timeout, 0)):
+                return None
+        try:
+            future = self.__executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self.__slots.release()
+            raise
+        with self.__lock:
+            self.pending += 1
+        future.add_done_callback(self.__done)
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.__executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+    def stats(self):
+        with self.__lock:
+            return {'processes': self.processes, 'max_pending': self.max_pending,
+                    'pending': self.pending, 'completed': self.completed,
+                    'waited': self.waited}
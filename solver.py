@@ -1,6 +1,8 @@
 import random
 import math
 
+import numpy as np
+
 import minesweeper_game as mg
 import minesweeper_classes as mc
 
@@ -50,6 +52,14 @@ class MinesweeperSolver:
         # Populated by "generate_groups"
         self.groups = mc.AllGroups()
 
+        # Groups of each numbered cell {cell: MineGroup}.
+        # Populated by "generate_groups", kept up to date by "update_state"
+        self.cell_groups = {}
+
+        # Copy of the field from the previous incremental solve() call.
+        # None means the next call starts from scratch.
+        self.previous_field = None
+
         # Placeholder for clusters (collections of groups)
         # Populated by method_csp
         self.all_clusters = mc.AllClusters(self.covered_cells,
@@ -76,6 +86,10 @@ class MinesweeperSolver:
         # ("Method name", "Probability sub method name", Probability of a mine)
         self.last_move_info = None
 
+        # Names of the methods used for each move by is_game_deterministic,
+        # a rough measure of how hard the game is
+        self.move_methods = []
+
     def copy(self):
         ''' Create a copy of solver object.
         Reuse settings and helper from the original one.
@@ -104,41 +118,112 @@ class MinesweeperSolver:
             if self.field[cell] == mg.CELL_MINE:
                 self.remaining_mines -= 1
 
+    def cell_group(self, cell):
+        ''' MineGroup of the covered neighbors around a numbered cell,
+        None if cell is not a number or has no covered neighbors
+        '''
+        # Groups are only for numbered cells
+        if self.field[cell] <= 0:
+            return None
+
+        # For them we'll need to know two things:
+        # What are the uncovered cells around it
+        covered_neighbors = []
+        # And how many "Active" (that is, minus marked)
+        # mines are still there
+        active_mines = self.field[cell]
+
+        # Go through the neighbors
+        for neighbor in self.helper.cell_surroundings(cell):
+            # Collect all covered cells
+            if self.field[neighbor] == mg.CELL_COVERED:
+                covered_neighbors.append(neighbor)
+            # Subtract all marked mines
+            if self.field[neighbor] == mg.CELL_MINE:
+                active_mines -= 1
+
+        # If the list of covered cells is empty, there is no group
+        if not covered_neighbors:
+            return None
+        return mc.MineGroup(covered_neighbors, active_mines)
+
     def generate_groups(self):
         ''' Populate self.group with MineGroup objects
         '''
 
         # Reset the groups
         self.groups.reset()
+        self.cell_groups = {}
 
         # Go over all cells and find all the "Numbered ones"
         for cell in self.helper.iterate_over_all_cells():
+            new_group = self.cell_group(cell)
+            # store it in the self.groups
+            if new_group is not None:
+                self.cell_groups[cell] = new_group
+                self.groups.add_group(new_group)
 
-            # Groups are only for numbered cells
-            if self.field[cell] <= 0:
-                continue
+    def update_state(self, field):
+        ''' Incremental version of generate_all_covered,
+        calculate_remaining_mines and generate_groups. Only cells that
+        changed since the previous call, and their neighbors, are looked at.
+        '''
+        self.field = field
 
-            # For them we'll need to know two things:
-            # What are the uncovered cells around it
-            covered_neighbors = []
-            # And how many "Active" (that is, minus marked)
-            # mines are still there
-            active_mines = self.field[cell]
+        # Nothing to start from: do it the normal way
+        if self.previous_field is None or \
+           self.previous_field.shape != field.shape:
+            self.generate_all_covered()
+            self.calculate_remaining_mines()
+            self.generate_groups()
+            self.previous_field = field.copy()
+            return
 
-            # Go through the neighbors
-            for neighbor in self.helper.cell_surroundings(cell):
-                # Collect all covered cells
-                if self.field[neighbor] == mg.CELL_COVERED:
-                    covered_neighbors.append(neighbor)
-                # Subtract all marked mines
-                if self.field[neighbor] == mg.CELL_MINE:
-                    active_mines -= 1
+        changed = [tuple(cell) for cell in
+                   np.argwhere(field != self.previous_field)]
+        if not changed:
+            self.restore_groups()
+            return
 
-            # If the list of covered cells is not empty:
-            # store it in the self.groups
-            if covered_neighbors:
-                new_group = mc.MineGroup(covered_neighbors, active_mines)
-                self.groups.add_group(new_group)
+        # Covered cells and mines
+        opened = set()
+        for cell in changed:
+            if self.previous_field[cell] == mg.CELL_COVERED:
+                opened.add(cell)
+            if self.previous_field[cell] == mg.CELL_MINE:
+                self.remaining_mines += 1
+            if field[cell] == mg.CELL_MINE:
+                self.remaining_mines -= 1
+            if field[cell] == mg.CELL_COVERED:
+                # Never happens during a game, recount everything
+                self.previous_field = None
+                self.update_state(field)
+                return
+        self.covered_cells = [cell for cell in self.covered_cells
+                              if cell not in opened]
+
+        # Only numbers around the changed cells can have different groups
+        affected = set(changed)
+        for cell in changed:
+            affected.update(self.helper.cell_surroundings(cell))
+        for cell in affected:
+            new_group = self.cell_group(cell)
+            if new_group is None:
+                self.cell_groups.pop(cell, None)
+            else:
+                self.cell_groups[cell] = new_group
+
+        self.restore_groups()
+        self.previous_field = field.copy()
+
+    def restore_groups(self):
+        ''' Reset self.groups to the groups of numbered cells
+        (dropping groups added by the solving methods)
+        '''
+        self.groups.reset()
+        # Same order as generate_groups
+        for cell in sorted(self.cell_groups):
+            self.groups.add_group(self.cell_groups[cell])
 
     def generate_clusters(self):
         ''' Initiate self.all_clusters and populate it with
@@ -187,6 +272,7 @@ class MinesweeperSolver:
             Uses greedy method to maximize the number of cells in the coverage
             '''
 
+            accounted_mask = mc.cells_mask(accounted_cells)
             while True:
                 # The idea is to find a group that has a largest number of
                 # unaccounted cells
@@ -196,7 +282,7 @@ class MinesweeperSolver:
 
                     # If group overlaps with what we have so far -
                     # we don't need such group
-                    if accounted_cells.intersection(group.cells):
+                    if accounted_mask & group.mask:
                         continue
 
                     # Find the biggest group that we haven't touched yet
@@ -208,6 +294,7 @@ class MinesweeperSolver:
                 if best_group is not None:
                     # Cells from that group from now on are accounted for
                     accounted_cells = accounted_cells.union(best_group.cells)
+                    accounted_mask |= best_group.mask
                     # And so are  mines
                     accounted_mines += best_group.mines
                 # No such  group was found: coverage is done
@@ -294,7 +381,7 @@ class MinesweeperSolver:
         # For that, we need two conditions:
         # 1. A is a subset of B (only checks this way, so external function
         # need to make sure this function called both ways).
-        if group_a.cells.issubset(group_b.cells):
+        if group_a.is_subset(group_b):
 
             # 2. They have the same number of mines.
             # If so, difference is safe
@@ -310,13 +397,13 @@ class MinesweeperSolver:
         ''' Given two mine groups, deduce if there are any mines.
         Similar to deduce_safe, but for mines.
         '''
-        if group_a.cells.issubset(group_b.cells):
+        if group_a.is_subset(group_b):
 
             # 2. If difference in number of cells is the same as
             # difference in number of mines: difference is mines
             # For example if A (1, 2) has 1 mine and B (1, 2, 3) has 2 mines,
             # cell 3 is a mine
-            if len(group_b.cells - group_a.cells) == \
+            if len(group_b.cells) - len(group_a.cells) == \
                     group_b.mines - group_a.mines:
                 return list(group_b.cells - group_a.cells)
 
@@ -347,14 +434,18 @@ class MinesweeperSolver:
         '''
         safe, mines = [], []
 
-        # Cross-check all-with-all groups
+        # Cross-check all groups with the groups they may be a subset of
         for group_a in self.groups:
-            for group_b in self.groups:
+            for group_b in self.groups.superset_candidates(group_a):
 
                 # Don't compare with itself
                 if group_a.hash == group_b.hash:
                     continue
 
+                # Nothing to deduce unless A is a subset of B
+                if not group_a.is_subset(group_b):
+                    continue
+
                 safe.extend(self.deduce_safe(group_a, group_b))
                 mines.extend(self.deduce_mines(group_a, group_b))
 
@@ -364,10 +455,10 @@ class MinesweeperSolver:
                 # len(group_b.cells) < 8 prevents computational explosion on
                 # multidimensional fields
                 if len(group_b.cells) < 8 and \
-                   group_a.cells.issubset(group_b.cells) and \
                    group_b.mines - group_a.mines > 0:
                     new_group = mc.MineGroup(group_b.cells - group_a.cells,
-                                             group_b.mines - group_a.mines)
+                                             group_b.mines - group_a.mines,
+                                             mask=group_b.mask & ~group_a.mask)
                     self.groups.add_group(new_group)
 
         return list(set(safe)), list(set(mines))
@@ -394,8 +485,13 @@ class MinesweeperSolver:
         # subgroups
         # Group A are all subgroups (at least, no more)
         for group_a in self.groups.subgroups():
-            # Group B are all groups (exactly)
-            for group_b in self.groups.exact_groups():
+            # Group B are all groups (exactly) it may be a subset of
+            for group_b in self.groups.superset_candidates(group_a,
+                                                           exact_only=True):
+
+                # Nothing to deduce unless A is a subset of B
+                if not group_a.is_subset(group_b):
+                    continue
 
                 # Only compare subgroups "at least" to groups.
                 if group_a.group_type == "at least":
@@ -622,7 +718,8 @@ class MinesweeperSolver:
         '''
         return random.choice(cells)
 
-    def solve(self, field, next_moves=1, deterministic=False):
+    def solve(self, field, next_moves=1, deterministic=False,
+              incremental=False, probabilities=True):
         ''' Main solving function.
         Go through various solving methods and return safe and mines lists
         as long as any of the methods return results
@@ -632,6 +729,11 @@ class MinesweeperSolver:
           future boards. 1 - look 1 move ahead etc
         - deterministic: don't use random at all. In case of several equally
           probably safe cells, pick the first one
+        - incremental: reuse covered cells and groups from the previous
+          incremental call, only updating what changed in the field
+        - probabilities: when no safe cells or mines can be found, calculate
+          mine probabilities to pick the luckiest cell. If False, return
+          no cells instead (only the fact that a guess is needed is of use)
         Out:
         - list of safe cells
         - list of mines
@@ -639,19 +741,29 @@ class MinesweeperSolver:
         # Store field as an instance variable
         self.field = field
 
+        if incremental:
+            # Covered cells, remaining mines and groups,
+            # updated from the previous call
+            self.update_state(field)
+            all_covered = len(self.covered_cells) == field.size
+        else:
+            self.previous_field = None
+            all_covered = self.helper.are_all_covered(self.field)
+
         # First click on the "all 0" corner
-        if self.helper.are_all_covered(self.field):
+        if all_covered:
             self.last_move_info = ("First click", None, None)
             all_zeros = tuple(0 for _ in range(len(self.shape)))
             return [all_zeros, ], None
 
-        # Several calculation needed for the following solution methods
-        # A list of all covered cells
-        self.generate_all_covered()
-        # Number of remaining mines
-        self.calculate_remaining_mines()
-        # Generate groups (main data for basic solving methods)
-        self.generate_groups()
+        if not incremental:
+            # Several calculation needed for the following solution methods
+            # A list of all covered cells
+            self.generate_all_covered()
+            # Number of remaining mines
+            self.calculate_remaining_mines()
+            # Generate groups (main data for basic solving methods)
+            self.generate_groups()
         # Unaccounted cells (covered minus mines, has  to go after the  groups)
         self.generate_unaccounted()
 
@@ -682,6 +794,10 @@ class MinesweeperSolver:
         if self.bruteforce_solutions == []:
             return [-1], [-1]
 
+        if not probabilities:
+            self.last_move_info = ("Probability", None, None)
+            return [], None
+
         # Calculate mine probability using various methods
         self.calculate_probabilities()
         # Calculate safe cells for the next move in CSP
@@ -722,15 +838,25 @@ class MinesweeperSolver:
         self.last_move_info = ("Last Resort", None, None)
         return [self.pick_a_random_cell(self.covered_cells), ], None
 
-    def is_game_deterministic(self, game):
+    def is_game_deterministic(self, game, resume=False):
         '''
         Returns true if no guess required to solve the game, false otherwise.
+        Solver state is updated incrementally from one move to the next.
+        If a guess is required, game is left at the position where
+        the solver got stuck.
+        - resume: keep the state of the previous call on the same game,
+        for when only a few opened numbers have changed since.
         '''
+        if not resume:
+            self.previous_field = None
+            self.move_methods = []
         while game.status == mg.STATUS_ALIVE:
-            safe, mines = self.solve(game.uncovered, next_moves=1)
+            safe, mines = self.solve(game.uncovered, next_moves=1,
+                                     incremental=True, probabilities=False)
             method, random_method, chance = self.last_move_info
             if method == 'Probability':
                 return False
+            self.move_methods.append(method)
             game.make_a_move(safe, mines)
         return True
 
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from threading import Lock
+
+# upper bounds of the attempts histogram buckets, the last one is open
+ATTEMPTS_BUCKETS = (1, 2, 4, 8, 16, 32)
+
+# what a generation was for: a first click waiting for it, a BoardPool refill,
+# or continue_generation after the first click ran out of time
+SOURCE_CLICK = 'click'
+SOURCE_POOL = 'pool'
+SOURCE_BACKGROUND = 'background'
+# in report order
+SOURCE_NAMES = {SOURCE_CLICK: '首次点击', SOURCE_POOL: '预生成', SOURCE_BACKGROUND: '后台补生成'}
+
+def bucket_label(index):
+    if index == len(ATTEMPTS_BUCKETS):
+        return f"{ATTEMPTS_BUCKETS[-1] + 1}+"
+    upper = ATTEMPTS_BUCKETS[index]
+    lower = ATTEMPTS_BUCKETS[index - 1] + 1 if index > 0 else 1
+    return str(upper) if lower == upper else f"{lower}-{upper}"
+
+class GenerationStats:
+    '''
+        Counters and timers of map generation, by (source, height, width, mines).
+        attempts are solver runs, a fallback is a map served without being guess free,
+        a swap is a fallback of a first click replaced by a guess-free map later.
+    '''
+    def __init__(self):
+        self.__lock = Lock()
+        self.__entries = dict()
+    def __entry(self, key):
+        entry = self.__entries.get(key)
+        if entry is None:
+            entry = self.__entries[key] = {
+                'generations': 0, 'successes': 0, 'fallbacks': 0, 'swaps': 0,
+                'attempts': 0, 'success_attempts': 0,
+                'histogram': [0] * (len(ATTEMPTS_BUCKETS) + 1),
+                'solver_time': 0.0, 'gen_time': 0.0}
+        return entry
+    def record(self, height, width, mines, attempts, guessfree, solver_time, gen_time,
+               source=SOURCE_CLICK):
+        with self.__lock:
+            entry = self.__entry((source, height, width, mines))
+            entry['generations'] += 1
+            entry['attempts'] += attempts
+            if guessfree:
+                entry['successes'] += 1
+                entry['success_attempts'] += attempts
+            else:
+                entry['fallbacks'] += 1
+            for (index, upper) in enumerate(ATTEMPTS_BUCKETS):
+                if attempts <= upper:
+                    break
+            else:
+                index = len(ATTEMPTS_BUCKETS)
+            entry['histogram'][index] += 1
+            entry['solver_time'] += solver_time
+            entry['gen_time'] += gen_time
+    def record_swap(self, height, width, mines):
+        '''A first click fallback got a guess-free map after all'''
+        with self.__lock:
+            self.__entry((SOURCE_CLICK, height, width, mines))['swaps'] += 1
+    def snapshot(self):
+        '''{(source, height, width, mines): counters}, with derived ratios'''
+        with self.__lock:
+            entries = {key: dict(entry, histogram=list(entry['histogram']))
+                       for (key, entry) in self.__entries.items()}
+        for ((source, height, width, mines), entry) in entries.items():
+            entry['density'] = mines / (height * width)
+            entry['attempts_per_success'] = entry['success_attempts'] / entry['successes'] \
+                                            if entry['successes'] else None
+            entry['solver_time_per_attempt'] = entry['solver_time'] / entry['attempts'] \
+                                               if entry['attempts'] else None
+            entry['fallback_ratio'] = entry['fallbacks'] / entry['generations'] \
+                                      if entry['generations'] else None
+            entry['gen_time_avg'] = entry['gen_time'] / entry['generations'] \
+                                    if entry['generations'] else None
+        return entries
+    def report(self):
+        lines = list()
+        order = list(SOURCE_NAMES)
+        for ((source, height, width, mines), entry) in sorted(
+                self.snapshot().items(), key=lambda item: (order.index(item[0][0]), item[0])):
+            if not entry['generations']:
+                continue
+            line = (f"[{SOURCE_NAMES[source]}] {height}x{width}/{mines} ({entry['density']:.0%}): "
+                    f"生成{entry['generations']}次，回退{entry['fallback_ratio']:.1%}，"
+                    f"{entry['gen_time_avg'] * 1000:.1f}ms/局")
+            if entry['swaps']:
+                line += f"，之后换成无猜{entry['swaps']}次"
+            lines.append(line)
+            if entry['attempts_per_success'] is not None:
+                lines.append(f"  每次成功尝试{entry['attempts_per_success']:.2f}次")
+            if entry['solver_time_per_attempt'] is not None:
+                lines.append(f"  求解{entry['solver_time_per_attempt'] * 1000:.1f}ms/次")
+            histogram = ' '.join(f"{bucket_label(index)}:{count}"
+                                 for (index, count) in enumerate(entry['histogram']) if count)
+            lines.append(f"  尝试次数 {histogram}")
+        return "\n".join(lines) if lines else "还没有生成过地图"
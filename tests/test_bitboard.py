@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import random
+import pickle
+import unittest
+
+import numpy as np
+
+import mscore
+from mscore import Board, BoardTemplate
+from bitboard import BitBoard
+
+class ParityTest(unittest.TestCase):
+    '''BitBoard plays exactly like Board'''
+    def assertSame(self, board, bitboard):
+        self.assertTrue((board.map == bitboard.map).all())
+        self.assertEqual(board.state, bitboard.state)
+        self.assertEqual(board.unopened, bitboard.unopened)
+        self.assertEqual(board.mines_opened, bitboard.mines_opened)
+
+    def test_random_games(self):
+        rng = np.random.default_rng(1)
+        moves = random.Random(1)
+        for _ in range(200):
+            (height, width) = (moves.randint(2, 10), moves.randint(2, 8))
+            mines = moves.randint(0, height * width - 2)
+            first_move = (moves.randrange(height), moves.randrange(width))
+            layout = mscore.draw_layout(height, width, mines, first_move, rng=rng)
+            board = Board(height, width, mines)
+            bitboard = BitBoard(height, width, mines)
+            board.load(layout)
+            bitboard.load(layout)
+            board.state = bitboard.state = 1
+            self.assertEqual(board.gen_statistics(), bitboard.gen_statistics())
+            for move in [first_move] + [(moves.randrange(height), moves.randrange(width))
+                                        for _ in range(30)]:
+                self.assertEqual(board.move(move), bitboard.move(move))
+                self.assertSame(board, bitboard)
+                # go on after stepping on a mine, to play chords on it too
+                if board.state == 3:
+                    board.state = bitboard.state = 1
+            bitboard = pickle.loads(pickle.dumps(bitboard))
+            self.assertSame(board, bitboard)
+
+    def test_template(self):
+        template = BoardTemplate.generate(8, 8, 12, rng=np.random.default_rng(3))
+        board = Board.from_template(template)
+        bitboard = BitBoard.from_template(template)
+        self.assertSame(board, bitboard)
+        self.assertEqual(board.gen_statistics(), bitboard.gen_statistics())
+        for move in [(row, col) for row in range(8) for col in range(8)]:
+            self.assertEqual(board.move(move), bitboard.move(move))
+            self.assertSame(board, bitboard)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import unittest
+
+import numpy as np
+
+import mscore
+from boardpool import TRANSFORMS, transform_move, transform_layout, untransform_layout
+
+def is_deterministic(layout, first_move):
+    (game, solver) = mscore.start_game(np.ascontiguousarray(layout), first_move)
+    return bool(solver.is_game_deterministic(game))
+
+class SymmetryTest(unittest.TestCase):
+    '''A layout moved by any symmetry of the board is the same game'''
+    def test_transforms(self):
+        rng = np.random.default_rng(0)
+        for (height, width, mines, first_move) in [(8, 8, 10, (1, 2)), (5, 8, 8, (0, 3)),
+                                                   (8, 5, 12, (4, 4)), (3, 7, 5, (2, 0))]:
+            layout = mscore.draw_layout(height, width, mines, first_move, rng=rng)
+            for transform in TRANSFORMS:
+                (t_height, t_width, t_move) = transform_move(height, width, first_move, transform)
+                moved = transform_layout(layout, transform)
+                self.assertEqual(moved.shape, (t_height, t_width))
+                self.assertEqual(moved[t_move], layout[first_move])
+                self.assertTrue((mscore.count_neighbours(moved == mscore.IS_MINE) == moved).all())
+                self.assertTrue((untransform_layout(moved, transform) == layout).all())
+
+    def test_same_verdict(self):
+        rng = np.random.default_rng(7)
+        for (height, width, mines) in [(8, 8, 10), (9, 6, 12), (10, 10, 25)]:
+            for _ in range(10):
+                first_move = (int(rng.integers(height)), int(rng.integers(width)))
+                layout = mscore.draw_layout(height, width, mines, first_move, rng=rng)
+                verdict = is_deterministic(layout, first_move)
+                for transform in TRANSFORMS:
+                    (_, _, t_move) = transform_move(height, width, first_move, transform)
+                    moved = transform_layout(layout, transform)
+                    self.assertEqual(is_deterministic(moved, t_move), verdict)
+
+if __name__ == '__main__':
+    unittest.main()
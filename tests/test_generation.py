@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+import unittest
+from time import perf_counter
+
+import mscore
+from mscore import Board
+from bitboard import BitBoard
+from procpool import WorkerPool
+
+class ParallelGenerationTest(unittest.TestCase):
+    '''gen_layout_parallel keeps to its budget and deadline'''
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = WorkerPool(2, max_pending=4)
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.shutdown()
+
+    def generate(self, height, width, mines, budget, deadline=None):
+        return mscore.gen_layout_parallel(self.pool, height, width, mines, (0, 0), budget,
+                                          mscore.MAX_REPAIRS, deadline=deadline)
+
+    def test_budget(self):
+        # 40% mines: hardly ever guess free, so the whole budget is used
+        for budget in (1, 5, 12, 40):
+            result = self.generate(10, 10, 40, budget)
+            self.assertLessEqual(result.attempts, budget)
+            self.assertEqual(int((result.layout == mscore.IS_MINE).sum()), 40)
+
+    def test_deadline(self):
+        start = perf_counter()
+        result = self.generate(16, 16, 100, 10 ** 6, deadline=start + 0.3)
+        self.assertLess(perf_counter() - start, 1.0)
+        self.assertEqual(int((result.layout == mscore.IS_MINE).sum()), 100)
+
+    def test_busy_pool(self):
+        executor = mscore.executor
+        mscore.executor = self.pool
+        try:
+            for cls in (Board, BitBoard):
+                sleeps = [self.pool.submit(time.sleep, 2) for _ in range(self.pool.max_pending)]
+                start = perf_counter()
+                board = cls(8, 8, 9)
+                board.move((4, 4), budget=0.2)
+                self.assertLess(perf_counter() - start, 1.0)
+                self.assertIn(board.state, (1, 2))
+                self.assertGreater(board.pending_attempts, 0)
+                for sleep in sleeps:
+                    sleep.result()
+        finally:
+            mscore.executor = executor
+
+if __name__ == '__main__':
+    unittest.main()
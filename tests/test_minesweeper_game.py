@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import unittest
+
+import minesweeper_game as mg
+
+class FieldTest(unittest.TestCase):
+    '''export_field / import_field'''
+    def test_roundtrip(self):
+        for (settings, seed) in [(mg.GAME_BEGINNER, 1), (mg.GAME_EXPERT, 2),
+                                 (mg.GAME_3D_EASY, 3), (mg.GAME_4D_EASY, 4), (mg.GAME_1D, 5)]:
+            game = mg.MinesweeperGame(settings, seed=seed)
+            field_str = game.export_field()
+            self.assertEqual(len(field_str), game.field.size)
+            copy = mg.MinesweeperGame(settings, field_str=field_str)
+            self.assertTrue((copy.field == game.field).all())
+            self.assertEqual(copy.export_field(), field_str)
+
+if __name__ == '__main__':
+    unittest.main()
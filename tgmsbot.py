@@ -1,12 +1,15 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-from mscore import Board, check_params
-from copy import deepcopy
+import mscore
+from mscore import Board, BoardTemplate, check_params
+from boardpool import BoardPool
+from procpool import WorkerPool
+from corpus import Corpus
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import Updater, CommandHandler, CallbackQueryHandler
 from telegram.error import TimedOut as TimedOutError, RetryAfter as RetryAfterError
-from numpy import array_equal
 from random import randint, choice, randrange
+from numpy.random import default_rng
 from math import log
 from threading import Lock, Thread
 import time
@@ -25,6 +28,25 @@ except ModuleNotFoundError:
     logger.warning('using data_ram instead of data')
     from data_ram import get_player, db
 
+# processes for map generation and solving, 0 to run them in the bot process
+GEN_PROCESSES = os.cpu_count() or 1
+# generation tasks queued or running at the same time, submitting more waits
+GEN_MAX_PENDING = GEN_PROCESSES * 2
+# processes of their own for pool refills and the search after a first click
+# ran out of time, so that they never hold up a first click
+GEN_BACKGROUND_PROCESSES = max(1, GEN_PROCESSES // 4)
+
+if GEN_PROCESSES > 0:
+    # fork the workers now, before any other thread is started
+    gen_executor = WorkerPool(GEN_PROCESSES, max_pending=GEN_MAX_PENDING)
+    gen_background = WorkerPool(GEN_BACKGROUND_PROCESSES)
+    setattr(mscore, 'executor', gen_executor)
+    setattr(mscore, 'background_executor', gen_background)
+    setattr(mscore, 'SPECULATIVE_BATCH', GEN_PROCESSES)
+else:
+    gen_executor = None
+    gen_background = None
+
 token = os.getenv('TOKEN', 'token here or the env var')
 updater = Updater(token, workers=8, use_context=True)
 job_queue = updater.job_queue
@@ -41,6 +63,26 @@ HEIGHT = 8
 WIDTH = 8
 MINES = 9
 
+# pre-generated guess-free layouts for the first click
+POOL_HIGH_WATERMARK = 3
+POOL_LOW_WATERMARK = 1
+POOL_WORKERS = 1
+# after a game ends, get a board of the same size ready for the rematch,
+# kept for PREFETCH_TTL seconds
+PREFETCH_TTL = 120
+# /daily: one board for all chats, generated once a day
+DAILY_HEIGHT = 8
+DAILY_WIDTH = 8
+DAILY_MINES = 12
+# verified boards built offline with corpus.py, used if the file exists
+CORPUS_FILE = 'corpus.npy'
+# engine of new games: Board, or bitboard.BitBoard which keeps a game in a few
+# bitmasks (boards of at most 128 blocks, import it here to use it)
+BOARD_CLASS = Board
+# seconds the first click may spend on generating a map,
+# the search for a guess-free one goes on in the background afterwards
+GEN_BUDGET = 1.0
+
 UNOPENED_CELL = "\u25a0"
 FLAGGED_CELL = "\U0001f6a9"
 STEPPED_CELL = "\u2622\ufe0f"
@@ -114,6 +156,8 @@ class Game:
         self.lives = lives
         self.ttl_lives = lives
         self.lock = Lock()
+        # text of every block on the keyboard, by row
+        self.cell_texts = None
     @staticmethod
     def nobot(input):
         setattr(input, "bot", None)
@@ -126,6 +170,15 @@ class Game:
     def __setstate__(self, state):
         self.__dict__.update(state)
         self.lock = Lock()
+    def update_texts(self, rows=None):
+        '''Refresh cell_texts of the rows in the bitmask rows, all rows if None'''
+        board = self.board
+        if getattr(self, 'cell_texts', None) is None or rows is None:
+            self.cell_texts = [None] * board.height
+            rows = (1 << board.height) - 1
+        for row in range(board.height):
+            if rows >> row & 1:
+                self.cell_texts[row] = [cell_text(value) for value in board.map[row]]
     def save_action(self, user, spot):
         '''spot is supposed to be a tuple'''
         user = self.nobot(user)
@@ -221,6 +274,20 @@ class GameManager:
 
 game_manager = GameManager()
 
+board_pool = BoardPool(high_watermark=POOL_HIGH_WATERMARK,
+                       low_watermark=POOL_LOW_WATERMARK, workers=POOL_WORKERS)
+board_pool.track(HEIGHT, WIDTH, MINES)
+setattr(mscore, 'board_pool', board_pool)
+if Path(CORPUS_FILE).exists():
+    corpus = Corpus(CORPUS_FILE)
+    logger.info(f'{len(corpus)} boards in the corpus')
+    setattr(mscore, 'corpus', corpus)
+else:
+    corpus = None
+# (date, BoardTemplate) of /daily
+daily_template = None
+daily_lock = Lock()
+
 @run_async
 def list_games(update, context):
     logger.info("List from {0}".format(update.message.from_user.id))
@@ -261,19 +328,24 @@ def list_games(update, context):
         links.append(gen_link(gm.group, gm.msgid, f"{gm.creator.first_name} created on {time.ctime(gm.start_time)}"))
     update.message.reply_text("\n".join(links), parse_mode="Markdown")
 
-@run_async
-def send_keyboard(update, context):
-    (bot, args) = (context.bot, context.args)
-    msg = update.message
-    logger.info("Mine from {0}".format(update.message.from_user.id))
+def can_create_game(update):
     if check_restriction(update.message.from_user):
         update.message.reply_text("爆炸这么多次还想扫雷？")
-        return
+        return False
     for (_gid, _) in enumerate(game_manager.iter_game_from_user(update.message.from_user.id)):
         if _gid + 1 > MAX_GAMES_PER_USER:
             update.message.reply_text((f"汝已经创建了超过{MAX_GAMES_PER_USER}个游戏了\n"
                                         "请结束一个先前创建的游戏并继续"))
-            return
+            return False
+    return True
+
+@run_async
+def send_keyboard(update, context):
+    (bot, args) = (context.bot, context.args)
+    msg = update.message
+    logger.info("Mine from {0}".format(update.message.from_user.id))
+    if not can_create_game(update):
+        return
     # create a game board
     if args is None:
         args = list()
@@ -297,12 +369,12 @@ def send_keyboard(update, context):
             return
         ck = check_params(height, width, mines)
         if ck[0]:
-            board = Board(height, width, mines)
+            board = BOARD_CLASS(height, width, mines)
         else:
             msg.reply_text(ck[1])
             return
     elif len(args) == 0:
-        board = Board(HEIGHT, WIDTH, MINES)
+        board = BOARD_CLASS(HEIGHT, WIDTH, MINES)
     else:
         msg.reply_text('你输入的是什么鬼！')
         return
@@ -326,10 +398,43 @@ def send_keyboard(update, context):
         raise
     game_manager.get_game_from_hash(bhash).msgid = gmsg.message_id
 
+def get_daily_template():
+    '''Today's board, the same in every chat (and after a restart)'''
+    global daily_template
+    today = time.strftime('%Y%m%d')
+    with daily_lock:
+        if daily_template is None or daily_template[0] != today:
+            template = BoardTemplate.generate(DAILY_HEIGHT, DAILY_WIDTH, DAILY_MINES,
+                                              rng=default_rng(int(today)))
+            daily_template = (today, template)
+        return daily_template
+
+@run_async
+def send_daily(update, context):
+    bot = context.bot
+    msg = update.message
+    logger.info("Daily from {0}".format(update.message.from_user.id))
+    if not can_create_game(update):
+        return
+    (today, template) = get_daily_template()
+    board = BOARD_CLASS.from_template(template)
+    bhash = hash(board)
+    game = game_manager.append(board, bhash, msg.chat, msg.from_user)
+    keyboard = gen_keyboard(game, bhash, hash(game.last_action) % 100)
+    text = f"每日挑战 {today}，所有群同一张地图～"
+    text += "\n✅好耶～本局无猜" if board.guessfree else "\n❌坏耶！本局要猜"
+    try:
+        gmsg = bot.send_message(chat_id=msg.chat.id, text=text, reply_to_message_id=msg.message_id,
+                                reply_markup=InlineKeyboardMarkup(keyboard))
+    except Exception:
+        game_manager.remove(bhash)
+        raise
+    game.msgid = gmsg.message_id
+
 def send_help(update, context):
     logger.debug("Start from {0}".format(update.message.from_user.id))
     msg = update.message
-    msg.reply_text("这是一个扫雷bot\n\n/mine 开始新游戏")
+    msg.reply_text("这是一个扫雷bot\n\n/mine 开始新游戏\n/daily 每日挑战")
 
 def send_source(update, context):
     logger.debug("Source from {0}".format(update.message.from_user.id))
@@ -338,7 +443,32 @@ def send_source(update, context):
 def send_status(update, context):
     logger.info("Status from {0}".format(update.message.from_user.id))
     count = game_manager.count()
-    update.message.reply_text('当前进行的游戏: {}'.format(count))
+    pstats = board_pool.stats()
+    text = (f"当前进行的游戏: {count}\n"
+            f"预生成地图: {pstats['stored']} (命中{pstats['hits']}次，"
+            f"未命中{pstats['misses']}次)")
+    if corpus is not None:
+        cstats = corpus.stats()
+        text += (f"\n地图库: {cstats['boards']} (命中{cstats['hits']}次，"
+                 f"未命中{cstats['misses']}次)")
+    # /status gen: map generation details, for admins
+    if context.args and context.args[0] == 'gen' and \
+       get_player(update.message.from_user.id).permission >= cards.MAX_LEVEL:
+        text += (f"\n补充中 {pstats['refilling']}/{pstats['keys']}，"
+                 f"已生成{pstats['generated']}，丢弃{pstats['discarded']}，"
+                 f"放弃{pstats['dropped']}种\n"
+                 f"再来一局预生成{pstats['prefetches']}次，命中{pstats['prefetch_hits']}次，"
+                 f"过期{pstats['prefetch_expired']}次\n")
+        if gen_executor is not None:
+            estats = gen_executor.stats()
+            text += (f"生成进程 {estats['processes']}，队列 {estats['pending']}/"
+                     f"{estats['max_pending']}，完成{estats['completed']}，"
+                     f"排队等待{estats['waited']}次\n")
+            bstats = gen_background.stats()
+            text += (f"后台生成进程 {bstats['processes']}，队列 {bstats['pending']}/"
+                     f"{bstats['max_pending']}，完成{bstats['completed']}\n")
+        text += f"\n{mscore.gen_stats.report()}"
+    update.message.reply_text(text)
 
 def gen_reward(user, base, negative=True):
     ''' Reward the player :) '''
@@ -433,6 +563,25 @@ def update_keyboard_request(context, bhash, game, chat_id, message_id):
     else:
         game.last_action = current_action_timestamp
         update_keyboard(context, noqueue=(bhash, game, chat_id, message_id))
+def cell_text(value):
+    if value <= 9:
+        return UNOPENED_CELL
+    elif value == 10:
+        return NUM_CELL_0
+    elif value == 19:
+        return FLAGGED_CELL
+    elif value == 20:
+        return STEPPED_CELL
+    else:
+        return chr(NUM_CELL_ORD + value - 10)
+def gen_keyboard(game, bhash, tshash):
+    if getattr(game, 'cell_texts', None) is None:
+        game.update_texts()
+    keyboard = list()
+    for (row, texts) in enumerate(game.cell_texts):
+        keyboard.append([InlineKeyboardButton(text=text, callback_data=f"{bhash} {row} {col} {tshash}")
+                         for (col, text) in enumerate(texts)])
+    return keyboard
 def update_keyboard(context, noqueue=None):
     (bot, job) = (context.bot, context.job)
     if noqueue:
@@ -442,27 +591,7 @@ def update_keyboard(context, noqueue=None):
         if current_action_timestamp != game.last_action:
             logger.debug('New update action requested, abort this one.')
             return
-    def gen_keyboard(board):
-        tshash = hash(game.last_action) % 100
-        keyboard = list()
-        for row in range(board.height):
-            current_row = list()
-            for col in range(board.width):
-                if board.map[row][col] <= 9:
-                    cell_text = UNOPENED_CELL
-                elif board.map[row][col] == 10:
-                    cell_text = NUM_CELL_0
-                elif board.map[row][col] == 19:
-                    cell_text = FLAGGED_CELL
-                elif board.map[row][col] == 20:
-                    cell_text = STEPPED_CELL
-                else:
-                    cell_text = chr(NUM_CELL_ORD + board.map[row][col] - 10)
-                cell = InlineKeyboardButton(text=cell_text, callback_data=f"{bhash} {row} {col} {tshash}")
-                current_row.append(cell)
-            keyboard.append(current_row)
-        return keyboard
-    keyboard = gen_keyboard(game.board)
+    keyboard = gen_keyboard(game, bhash, hash(game.last_action) % 100)
     try:
         text = "✅好耶～本局无猜" if game.board.guessfree else "❌坏耶！本局要猜"
         text += f" ({STEPPED_CELL} {(game.board.mines - game.board.mines_opened):02})"
@@ -474,6 +603,25 @@ def update_keyboard(context, noqueue=None):
     except Exception:
         logger.critical(format_exc())
 
+@run_async
+def finish_generation(context, bhash, game, chat_id, message_id):
+    '''
+        Look for a guess-free map after the first click ran out of time,
+        and swap it in if nobody has clicked again meanwhile.
+    '''
+    layout = game.board.continue_generation()
+    if layout is None:
+        return
+    with game.lock:
+        if game.stopped or not game.board.swap_layout(layout):
+            logger.debug('Guess-free map for game {} came too late.'.format(bhash))
+            return
+        game.update_texts()
+    board = game.board
+    mscore.gen_stats.record_swap(board.height, board.width, board.mines)
+    logger.debug('Swapped in a guess-free map for game {}.'.format(bhash))
+    update_keyboard_request(context, bhash, game, chat_id, message_id)
+
 @run_async
 def handle_button_click(update, context):
     bot = context.bot
@@ -507,16 +655,16 @@ def handle_button_click(update, context):
             return
         game.lock.acquire()
         board = game.board
-        if board.state == 0:
-            mmap = None
-        else:
-            mmap = deepcopy(board.map)
-        board.move((row, col))
+        first_move = board.state == 0
+        result = board.move((row, col), budget=GEN_BUDGET)
+        game.update_texts(None if first_move else result.rows)
+        if first_move and board.pending_attempts:
+            finish_generation(context, bhash, game, chat_id, msg.message_id)
         if board.state != 1:
             game.stopped = True
             game.lock.release()
             game.save_action(user, (row, col))
-            if not array_equal(board.map, mmap) or hash(game.last_action) % 100 != tshash:
+            if result.cells or hash(game.last_action) % 100 != tshash:
                 update_keyboard_request(context, bhash, game, chat_id, msg.message_id)
             (s_op, s_is, s_3bv) = board.gen_statistics()
             ops_count = game.actions_sum()
@@ -561,7 +709,13 @@ def handle_button_click(update, context):
                 logger.critical(format_exc())
             if game.stopped:
                 game_manager.remove(bhash)
-        elif mmap is None or (not array_equal(board.map, mmap)) or hash(game.last_action) % 100 != tshash:
+                # the same first click as this game, or the centre;
+                # /daily boards come from a template, not from the pool
+                if not getattr(board, 'templated', False):
+                    board_pool.prefetch(board.height, board.width, board.mines,
+                                        [board.moves[0], (board.height // 2, board.width // 2)],
+                                        PREFETCH_TTL)
+        elif first_move or result.cells or hash(game.last_action) % 100 != tshash:
             game.lock.release()
             game.save_action(user, (row, col))
             update_keyboard_request(context, bhash, game, chat_id, msg.message_id)
@@ -592,15 +746,21 @@ updater.dispatcher.add_handler(CallbackQueryHandler(cards.dist_cards_btn_click,
 updater.dispatcher.add_handler(CommandHandler('start', send_help))
 updater.dispatcher.add_handler(CommandHandler('list', list_games))
 updater.dispatcher.add_handler(CommandHandler('mine', send_keyboard))
+updater.dispatcher.add_handler(CommandHandler('daily', send_daily))
 updater.dispatcher.add_handler(CommandHandler('status', send_status))
 updater.dispatcher.add_handler(CommandHandler('stats', player_statistics))
 updater.dispatcher.add_handler(CommandHandler('source', send_source))
 updater.dispatcher.add_handler(CallbackQueryHandler(handle_button_click))
 updater.job_queue.run_repeating(game_manager.do_garbage_collection, GARBAGE_COLLECTION_INTERVAL, first=30)
+board_pool.start()
 try:
     updater.start_polling()
     updater.idle()
 finally:
+    board_pool.stop()
+    if gen_executor is not None:
+        gen_executor.shutdown(wait=False, cancel_futures=True)
+        gen_background.shutdown(wait=False, cancel_futures=True)
     game_manager.save()
     logger.info('Game_manager saved.')
     db.close()